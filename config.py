@@ -29,6 +29,47 @@ MESSAGE_LIMIT_CONFIG_FILE = DATA_DIR / "message_limit_config.json"
 GACHA_FILE = DATA_DIR / "gacha.json"
 MYURION_FILE = DATA_DIR / "myurion_mode.json"
 SPECIAL_UNLOCKS_FILE = DATA_DIR / "special_unlocks.json"
+FORMS_FILE = DATA_DIR / "forms.json"
+SESSIONS_FILE = DATA_DIR / "sessions.json"
+OVERRIDES_FILE = DATA_DIR / "overrides.json"
+
+# 保存方式: "json"（従来の /data/*.json）または "sqlite"（/data/cyrene.db）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").strip().lower()
+SQLITE_FILE = DATA_DIR / "cyrene.db"
+
+# キャッシュの書き出し間隔（秒）
+STORAGE_FLUSH_INTERVAL = 5
+# ジャーナルをスナップショットへ畳み込む間隔（秒）と件数の上限
+STORAGE_COMPACT_INTERVAL = 300
+STORAGE_COMPACT_RECORDS = 5000
+
+# 好感度XPをまとめて書き込む間隔（秒）と件数
+XP_FLUSH_INTERVAL = 30
+XP_FLUSH_EVENTS = 200
+
+# 会話の途中状態（入力待ちなど）の有効期限（秒）と、期限切れを掃除する間隔（秒）
+SESSION_TTL = 600
+SESSION_ADMIN_TTL = 1800
+SESSION_TICK = 5
+
+# 設定ファイル（好感度・メッセージ制限）の更新を確認する間隔（秒）
+CONFIG_RELOAD_INTERVAL = 5
+
+# 送信のペース（1チャンネルあたり毎秒の通数と、まとめて送れる通数）と1通の上限文字数
+OUTBOX_RATE = 1.0
+OUTBOX_BURST = 5
+OUTBOX_MAX_LENGTH = 2000
+
+# 受信メッセージの処理: ワーカー数、行列の上限、重い処理を省き始める行列の長さ
+INBOUND_WORKERS = 8
+INBOUND_MAX_QUEUE = 500
+INBOUND_SHED_AT = 50
+
+# 一覧表示で使うメンバー表示名のキャッシュ期間（秒）
+MEMBER_NAME_TTL = 600
+
+# 起動時に先読みしておくフォーム（カンマ区切り。例: "cerydra,hyacinthia"）
+REPLY_WARMUP_FORMS = [k.strip() for k in os.getenv("REPLY_WARMUP_FORMS", "").split(",") if k.strip()]
 
 # タイムゾーン
 JST = timezone(timedelta(hours=9))
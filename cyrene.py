@@ -2,14 +2,31 @@
 import os
 import re
 import random
+import signal
+import asyncio
+from dataclasses import replace
 import discord
-from config import DISCORD_TOKEN, PRIMARY_ADMIN_ID
+from config import (
+    DISCORD_TOKEN, PRIMARY_ADMIN_ID, STORAGE_FLUSH_INTERVAL, SESSION_TICK, SESSIONS_FILE, REPLY_WARMUP_FORMS,
+)
 import database as db
+import storage
+import settings
 import logic
+import triggers
+import gacha_engine
 import reply_system as rs
 from lines import ARAFUE_TRIGGER_LINE
-from forms import get_user_form, set_user_form, resolve_form_code, get_form_display_name
-from special_unlocks import inc_janken_win, get_janken_wins, is_nanoka_unlocked, set_nanoka_unlocked, has_danheng_stage1, mark_danheng_stage1, is_danheng_unlocked, set_danheng_unlocked
+import special_unlocks
+from forms import resolve_form_code, resolve_form_spec, get_form_display_name, get_all_forms, get_form_overrides, set_user_form, set_all_forms
+from user_context import UserContext
+from router import Router, Request
+from sessions import SESSIONS, SessionState, ADMIN_STATES
+from members import MEMBER_NAMES
+from quota import QUOTA
+from outbox import OUTBOX
+from locks import USER_LOCKS
+from scheduler import SCHEDULER, PRIORITY_ADMIN, PRIORITY_SESSION, PRIORITY_COMMAND, PRIORITY_CHAT
 
 # --- Discord Setup ---
 intents = discord.Intents.default()
@@ -17,17 +34,19 @@ intents.message_content = True
 client = discord.Client(intents=intents)
 
 # --- State ---
-waiting_for_nickname = set()
-waiting_for_rename = set()
-admin_data_mode = set()
-waiting_for_admin_add = set()
-waiting_for_admin_remove = set()
-waiting_for_rps_choice = set()
-waiting_for_guardian_level = {}
-waiting_for_msg_limit = {}
-waiting_for_transform_code = set()
+# 入力待ちなどの会話状態は sessions.SESSIONS にまとめて持つ
 FORCE_RPS_WIN_NEXT = set()
-MYURION_QUIZ_STATE = {}
+
+# メンションなしでも反応するキーワード
+KEYWORD_TRIGGERS = triggers.register(
+    "じゃんけん", "変身", "ガチャ", "デイリー", "あだ名", "ミュリオン",
+    "親衛隊レベル", "好感度", "skopeo", "skepeo", "今の姿", "今のフォーム",
+    "記憶は流れ星"
+)
+
+COMMAND_QUERIES = ("コマンド", "コマンド教えて", "コマンドを教えて", "ヘルプ")
+# 入力待ちの外で使う管理者用コマンド（受け付け時の優先度の判定用。権限の確認はルート側）
+ADMIN_COMMAND_TEXTS = frozenset({"データ管理", "全体ミュリオンモード", "全体ミュリオン解除", "サーバーミュリオンモード", "サーバーミュリオン解除"})
 
 # --- Help Messages (柔らかい口調に修正) ---
 ADMIN_COMMANDS_LIST = (
@@ -38,11 +57,12 @@ ADMIN_COMMANDS_LIST = (
     "- `親衛隊レベル編集`: レベルの設定や削除ね\n"
     "- `好感度編集`: レベルの上がりやすさを調整できるわ\n"
     "- `好感度XP追加 @ユーザー 数値`: 経験値を直接あげちゃう？\n"
-    "- `好感度一覧`: みんなの愛の深さを確認しましょ♪\n"
+    "- `好感度一覧 [ページ]`: みんなの愛の深さを確認しましょ♪\n"
     "- `じゃんけん勝利数追加 @ユーザー 数値`: 勝ち数を操作しちゃうの？\n"
     "- `メッセージ制限編集`: お話しできる回数の制限設定よ\n"
     "- `メッセージ制限bypass編集`: 制限を無視できる人を決めるわ（メイン管理者のみ）\n"
     "- `変身管理`: 誰がどの姿か確認したり、変身させたりできるわ\n"
+    "- `一括変身 [サーバー] 姿`: みんなをまとめて変身させるわ\n"
     "- `変身解放状況確認`: 特別な姿の解放状況をチェック（メイン管理者のみ）\n"
     "- `データ管理終了`: 管理モードを終わるわね"
 )
@@ -64,18 +84,63 @@ GENERAL_COMMANDS_LIST = (
     "**★ ガチャ**\n"
     "- `ガチャメニュー`: 石やチケットの確認よ\n"
     "- `単発ガチャ` / `10連ガチャ`: 運試し、してみない？\n"
+    "- `100連ガチャ` / `天井までガチャ`: まとめて引いて結果だけ教えるわ\n"
     "- `デイリー受け取り`: 1日1回、石をプレゼントするわ♪\n\n"
     "**★ その他**\n"
     "- `ミュリオンモードオン`: ミュミュ語でお話しするわ～！\n"
     "- `コマンドを教えて`: このリストを見せるわ"
 )
 
-async def send_myu(message, user_id, text):
-    await message.channel.send(logic.apply_myurion_filter(user_id, text))
+async def send(message, text):
+    """返信は OUTBOX に積む（チャンネルごとにペースを守って送られる）"""
+    OUTBOX.post(message.channel, text)
+
+async def send_myu(message, ctx, text):
+    await send(message, logic.apply_myurion_filter(ctx, text))
+
+_background_started = False
+
+async def shutdown():
+    # 処理中のハンドラの返信と ctx.commit() を待ってから、送信待ちを送る
+    await SCHEDULER.join(timeout=5)
+    await OUTBOX.drain(timeout=5)
+    await client.close()
+
+async def storage_flush_loop():
+    while True:
+        await asyncio.sleep(STORAGE_FLUSH_INTERVAL)
+        logic.XP_ACCUMULATOR.maybe_flush()
+        QUOTA.flush()
+        await storage.aflush_all()
+        await settings.arefresh_all()
+        payload = SESSIONS.take_snapshot()
+        if payload is not None:
+            await storage.run_io(SESSIONS.write_snapshot, SESSIONS_FILE, payload)
+
+async def session_expiry_loop():
+    while True:
+        await asyncio.sleep(SESSION_TICK)
+        SESSIONS.tick()
 
 @client.event
 async def on_ready():
+    global _background_started
     print(f"Login: {client.user}")
+    await storage.aload_all()
+    await settings.arefresh_all()
+    if not _background_started:
+        _background_started = True
+        # 入力待ちなどのセッション。ファイルはここで読み、各ユーザーの分は次に話しかけたときに組み立てる
+        SESSIONS.restore(await storage.run_io(SESSIONS.read_snapshot, SESSIONS_FILE))
+        asyncio.create_task(rs.aload(REPLY_WARMUP_FORMS))
+        asyncio.create_task(storage_flush_loop())
+        asyncio.create_task(session_expiry_loop())
+        SCHEDULER.start()
+        # Railway の停止(SIGTERM)でも 送信待ちを送る → close → 最終フラッシュまで通す
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(shutdown()))
+        except NotImplementedError:
+            pass
 
 @client.event
 async def on_message(message):
@@ -83,270 +148,566 @@ async def on_message(message):
     user_id = message.author.id
     content = message.content.strip() # 原文
     
-    # 状態チェック
-    is_active_mode = (
-        user_id in waiting_for_nickname or user_id in waiting_for_rename or
-        user_id in waiting_for_admin_add or user_id in waiting_for_admin_remove or
-        user_id in waiting_for_rps_choice or user_id in admin_data_mode or
-        user_id in waiting_for_guardian_level or user_id in waiting_for_msg_limit or
-        user_id in waiting_for_transform_code or user_id in MYURION_QUIZ_STATE
-    )
+    # 状態チェック（入力待ちなどのセッションがあるか）
+    session = SESSIONS.get(user_id)
+    is_active_mode = session is not None
     
     # コマンド確認キーワード
-    is_command_query = content in ["コマンド", "コマンド教えて", "コマンドを教えて", "ヘルプ"]
+    is_command_query = content in COMMAND_QUERIES
 
     # キーワードトリガー
-    KEYWORD_TRIGGERS = [
-        "じゃんけん", "変身", "ガチャ", "デイリー", "あだ名", "ミュリオン", 
-        "親衛隊レベル", "好感度", "skopeo", "skepeo", "今の姿", "今のフォーム",
-        "記憶は流れ星"
-    ]
-    is_keyword_trigger = any(k in content for k in KEYWORD_TRIGGERS)
+    is_keyword_trigger = bool(triggers.scan(content) & KEYWORD_TRIGGERS)
     
     # 処理開始判定
     if not (client.user in message.mentions or is_active_mode or is_command_query or is_keyword_trigger):
         return
 
+    # 処理はワーカーに任せる。管理者コマンド・データ管理モード中・入力待ちへの返事を先に、雑談は後回し
+    # （ここではストアを読まない。文面とセッションだけで決める）
+    is_admin_command = re.sub(rf"<@!?{client.user.id}>", "", content).strip() in ADMIN_COMMAND_TEXTS
+    if is_admin_command or (is_active_mode and session.state in ADMIN_STATES): priority = PRIORITY_ADMIN
+    elif is_active_mode: priority = PRIORITY_SESSION
+    elif is_command_query or is_keyword_trigger: priority = PRIORITY_COMMAND
+    else: priority = PRIORITY_CHAT
+    SCHEDULER.submit(priority, handle_message, message)
+
+async def handle_message(message, degraded=False):
+    user_id = message.author.id
+    content = message.content.strip()
+
+    # ストアが未読み込みなら I/O スレッドで読む（以降の db.* はメモリのみ）
+    await storage.aload_all()
+
+    # 1日の回数制限を超えていたら、ほかの処理をする前に断る（お知らせは1日1回だけ）
+    if not QUOTA.consume(user_id):
+        if QUOTA.first_rejection(user_id):
+            await send(message, f"{message.author.mention} 今日はもうたくさんお話ししたわね。また明日ね♪")
+        return
+
     # メンション除去後のテキスト
     content_body = re.sub(rf"<@!?{client.user.id}>", "", content).strip()
-    nickname = db.get_nickname(user_id)
-    name = nickname if nickname else message.author.display_name
-    current_form = get_user_form(user_id)
-    
-    # --- コマンド一覧表示 ---
-    if is_command_query:
-        if user_id in admin_data_mode:
-            await send_myu(message, user_id, ADMIN_COMMANDS_LIST)
-        else:
-            await send_myu(message, user_id, f"{message.author.mention} {GENERAL_COMMANDS_LIST}")
-        return
 
-    # --- 管理者コマンド（全体設定） ---
-    if content_body == "全体ミュリオンモード" and db.is_admin(user_id):
-        db.set_all_myurion_enabled(True)
-        await message.channel.send(f"{message.author.mention} 全員ミュリオンモードON！ ミュミュ〜♪")
-        return
-    if content_body == "全体ミュリオン解除" and db.is_admin(user_id):
-        db.set_all_myurion_enabled(False)
-        await message.channel.send(f"{message.author.mention} 全員ミュリオンモード解除。普通の言葉に戻るわね。")
-        return
+    # 同じユーザーのメッセージは1つずつ（読み込み → 書き換え → 書き戻しが混ざらないように）
+    async with USER_LOCKS.hold(user_id):
+        # このメッセージで使うユーザー状態をまとめて読み込み、最後に一度だけ書き戻す
+        # （行列が詰まっているときは degraded: 好感度XPとミュリオン変換を省く）
+        ctx = UserContext.load(user_id, message.author.display_name, message.guild.id if message.guild else None)
+        ctx.degraded = degraded
+        # 変身したばかりの姿のセリフも、ここで I/O スレッドに読ませてから返事を作る
+        await rs.aload([ctx.form])
+        try:
+            # 積まれているあいだにセッションが終わっていることもあるので、ここで取り直す
+            await router.dispatch(Request(message, ctx, content_body, session=SESSIONS.get(user_id)))
+        finally:
+            ctx.commit()
 
-    # --- ミュリオンクイズ ---
-    if user_id in MYURION_QUIZ_STATE:
-        ans = logic.parse_myurion_answer(content_body)
-        if not ans:
-            await send_myu(message, user_id, f"{message.author.mention} 1〜4で答えてほしいミュ。")
-            return
-        state = MYURION_QUIZ_STATE[user_id]
-        if ans - 1 == state["correct_index"]:
-            total = db.add_myurion_correct(user_id)
-            if total >= 3 and not db.is_myurion_unlocked(user_id):
-                st = db.get_myurion_state(user_id)
-                st["unlocked"], st["enabled"] = True, True
-                db.save_myurion_state(user_id, st)
-                MYURION_QUIZ_STATE.pop(user_id, None)
-                await send_myu(message, user_id, f"{message.author.mention} 3問正解ミュ！ おめでとう、ミュリオンモード解放ミュ～♪")
-            else:
-                MYURION_QUIZ_STATE.pop(user_id, None)
-                await send_myu(message, user_id, f"{message.author.mention} 正解ミュ！ やるわね♪ (現在{total}/3)")
-        else:
-            MYURION_QUIZ_STATE.pop(user_id, None)
-            await send_myu(message, user_id, f"{message.author.mention} 残念、ハズレミュ…。また挑戦してね。")
+# --- ルーティング ---
+router = Router()
+
+def _is_admin(req): return db.is_admin(req.user_id)
+def _is_primary(req): return req.user_id == PRIMARY_ADMIN_ID
+def _in_admin_mode(req): return req.state in ADMIN_STATES
+def _in_primary_admin_mode(req): return _in_admin_mode(req) and _is_primary(req)
+
+def _parse_target(req):
+    """本文中のメンション（なければ数字のID）と、それ以外の数値を返す"""
+    m = re.search(r"<@!?(\d+)>", req.text) or re.search(r"\d{15,20}", req.text)
+    if m is None:
+        target, rest = None, req.text
+    else:
+        target, rest = int(m.group(m.lastindex or 0)), req.text.replace(m.group(), " ", 1)
+    nums = re.findall(r"-?\d+", rest)
+    return target, (int(nums[-1]) if nums else None)
+
+async def _member_names(guild, uids, limit=100):
+    """一覧表示用。表示しきれる先頭 limit 人分の表示名をまとめて引き、uid -> 表示名 の関数を返す"""
+    names = await MEMBER_NAMES.resolve(guild, [u for u in list(uids)[:limit] if str(u).isdigit()])
+    return lambda uid: names.get(int(uid), f"ID: {uid}")
+
+def _clip_lines(lines, limit=1900) -> str:
+    """Discord の 2000 文字制限に収まるように後ろを省略する"""
+    out, size = [], 0
+    for i, line in enumerate(lines):
+        if size + len(line) + 1 > limit:
+            out.append(f"…ほか {len(lines) - i} 件")
+            break
+        out.append(line)
+        size += len(line) + 1
+    return "\n".join(out)
+
+# --- コマンド一覧表示 ---
+@router.route(exact=COMMAND_QUERIES)
+async def route_help(req):
+    if _in_admin_mode(req):
+        await send_myu(req.message, req.ctx, ADMIN_COMMANDS_LIST)
+    else:
+        await send_myu(req.message, req.ctx, f"{req.mention} {GENERAL_COMMANDS_LIST}")
+
+# --- 管理者コマンド（全体設定） ---
+@router.route(exact=["全体ミュリオンモード"], guard=_is_admin)
+async def route_all_myurion_on(req):
+    db.set_all_myurion_enabled(True)
+    await send(req.message, f"{req.mention} 全員ミュリオンモードON！ ミュミュ〜♪")
+
+@router.route(exact=["全体ミュリオン解除"], guard=_is_admin)
+async def route_all_myurion_off(req):
+    db.set_all_myurion_enabled(False)
+    await send(req.message, f"{req.mention} 全員ミュリオンモード解除。普通の言葉に戻るわね。")
+
+@router.route(exact=["サーバーミュリオンモード", "サーバーミュリオン解除"], guard=_is_admin)
+async def route_guild_myurion(req):
+    if req.message.guild is None:
+        await send(req.message, f"{req.mention} サーバーの中で使ってね。")
         return
+    enabled = req.text == "サーバーミュリオンモード"
+    db.set_all_myurion_enabled(enabled, req.message.guild.id)
+    if enabled: await send(req.message, f"{req.mention} このサーバーのみんなをミュリオンモードON！ ミュミュ〜♪")
+    else: await send(req.message, f"{req.mention} このサーバーのミュリオンモード解除。普通の言葉に戻るわね。")
 
-    if "ミュウ、ミュミュミュウミュウ、ミュイー" in content_body:
-        st = db.get_myurion_state(user_id)
-        if st.get("unlocked"):
-            st["enabled"] = True
-            db.save_myurion_state(user_id, st)
-            await send_myu(message, user_id, f"{message.author.mention} もう解放されてるわよ♪ ミュリオンモードONミュ！")
-        else:
-            await logic.send_myurion_question(message, user_id, st.get("quiz_correct", 0), MYURION_QUIZ_STATE)
+# --- ミュリオンクイズ ---
+@router.route(state=SessionState.MYURION_QUIZ)
+async def route_myurion_quiz(req):
+    message, ctx, user_id = req.message, req.ctx, req.user_id
+    ans = logic.parse_myurion_answer(req.text)
+    if not ans:
+        await send_myu(message, ctx, f"{req.mention} 1〜4で答えてほしいミュ。")
         return
+    SESSIONS.end(user_id)
+    if ans - 1 == req.session.payload.get("correct_index"):
+        st = ctx.myurion
+        total = int(st.get("quiz_correct", 0)) + 1
+        st["quiz_correct"] = total
+        ctx.mark("myurion")
+        if total >= 3 and not ctx.myurion_unlocked:
+            st["unlocked"] = True
+            ctx.set_myurion_enabled(True)
+            await send_myu(message, ctx, f"{req.mention} 3問正解ミュ！ おめでとう、ミュリオンモード解放ミュ～♪")
+        else:
+            await send_myu(message, ctx, f"{req.mention} 正解ミュ！ やるわね♪ (現在{total}/3)")
+    else:
+        await send_myu(message, ctx, f"{req.mention} 残念、ハズレミュ…。また挑戦してね。")
+
+@router.route(contains=["ミュウ、ミュミュミュウミュウ、ミュイー"])
+async def route_myurion_phrase(req):
+    if req.ctx.myurion_unlocked:
+        req.ctx.set_myurion_enabled(True)
+        await send_myu(req.message, req.ctx, f"{req.mention} もう解放されてるわよ♪ ミュリオンモードONミュ！")
+    else:
+        quiz = await logic.send_myurion_question(req.message, req.ctx)
+        SESSIONS.start(req.user_id, SessionState.MYURION_QUIZ, quiz)
+
+@router.route(exact=["ミュリオンモードオン", "ミュリオンオン"])
+async def route_myurion_on(req):
+    if req.ctx.myurion_unlocked:
+        req.ctx.set_myurion_enabled(True)
+        await send_myu(req.message, req.ctx, "ミュリオンモードONミュ！ いっぱいお話ししよミュ♪")
+    else:
+        await send_myu(req.message, req.ctx, "まだその扉は開いてないみたい…。クイズに挑戦してみて？")
+
+@router.route(exact=["ミュリオンモードオフ", "ミュリオンオフ"])
+async def route_myurion_off(req):
+    req.ctx.set_myurion_enabled(False)
+    await send(req.message, "わかったわ、通常言語に戻るわね。")
+
+# --- 丹恒解放コード（空白・大文字小文字は無視） ---
+@router.route(when=lambda req: "skopeo365" in re.sub(r"\s+", "", req.text).lower())
+async def route_danheng_code(req):
+    ctx = req.ctx
+    if ctx.unlocks.get("danheng_stage1") and not ctx.unlocks.get("danheng_unlocked"):
+        ctx.set_unlock("danheng_unlocked", True)
+        await send_myu(req.message, ctx, "丹恒の記憶が…蘇ったみたい♪ 『たんたんになってみて』と言ってみて？")
+    elif ctx.unlocks.get("danheng_unlocked"):
+        await send_myu(req.message, ctx, "ふふっ、その姿ならもう解放されているわよ♪")
+    else:
+        await send_myu(req.message, ctx, "ん〜…まだ何かが足りないみたいね。")
+    SESSIONS.end(req.user_id, SessionState.TRANSFORM_CODE)
 
-    if content_body in ["ミュリオンモードオン", "ミュリオンオン"]:
-        st = db.get_myurion_state(user_id)
-        if st.get("unlocked"):
-            st["enabled"] = True
-            db.save_myurion_state(user_id, st)
-            await send_myu(message, user_id, "ミュリオンモードONミュ！ いっぱいお話ししよミュ♪")
+# --- 変身コード待ち ---
+@router.route(state=SessionState.TRANSFORM_CODE)
+async def route_transform_code(req):
+    message, ctx, t_text = req.message, req.ctx, req.text
+    SESSIONS.end(req.user_id)
+
+    if "なのになってみて" in t_text:
+        if ctx.unlocks.get("nanoka_unlocked"):
+            ctx.set_form("nanoka")
+            await send_myu(message, ctx, "今日から三月なのか/長夜月の姿になるわ♪ よろしくねっ！")
         else:
-            await send_myu(message, user_id, "まだその扉は開いてないみたい…。クイズに挑戦してみて？")
+            await send_myu(message, ctx, "まだ条件が足りないみたい…。じゃんけんにいっぱい勝ってみて？")
         return
-    
-    if content_body in ["ミュリオンモードオフ", "ミュリオンオフ"]:
-        st = db.get_myurion_state(user_id)
-        st["enabled"] = False
-        db.save_myurion_state(user_id, st)
-        await message.channel.send("わかったわ、通常言語に戻るわね。")
+    if "たんたんになってみて" in t_text:
+        if ctx.unlocks.get("danheng_unlocked"):
+            ctx.set_form("danheng")
+            await send_myu(message, ctx, "…わかった。丹恒の姿になろう。")
+        else:
+            await send_myu(message, ctx, "鍵が足りないみたい。")
         return
 
-    # --- 丹恒解放コード ---
-    if "skopeo365" in re.sub(r"\s+", "", content_body).lower():
-        if has_danheng_stage1(user_id) and not is_danheng_unlocked(user_id):
-            set_danheng_unlocked(user_id, True)
-            await send_myu(message, user_id, "丹恒の記憶が…蘇ったみたい♪ 『たんたんになってみて』と言ってみて？")
-        elif is_danheng_unlocked(user_id):
-            await send_myu(message, user_id, "ふふっ、その姿ならもう解放されているわよ♪")
-        else:
-            await send_myu(message, user_id, "ん〜…まだ何かが足りないみたいね。")
-        waiting_for_transform_code.discard(user_id)
+    fk = resolve_form_code(t_text)
+    if fk:
+        ctx.set_form(fk)
+        await send_myu(message, ctx, f"**{get_form_display_name(fk)}** に変身したわ♪ どう？似合う？")
+    else:
+        await send_myu(message, ctx, "そのコードは知らないみたい…。もう一度確認してくれる？")
+
+# --- データ管理モード：コマンド ---
+@router.route(exact=["データ管理終了"], guard=_in_admin_mode)
+async def route_admin_exit(req):
+    SESSIONS.end(req.user_id)
+    await send_myu(req.message, req.ctx, "データ管理モード、終了ね。また必要になったら呼んでちょうだい♪")
+
+@router.route(exact=["ニックネーム確認"], guard=_in_admin_mode)
+async def route_admin_nicknames(req):
+    data = db.load_nicknames()
+    if not data:
+        await send_myu(req.message, req.ctx, "まだ誰もあだ名を登録していないみたい。")
         return
+    name_of = await _member_names(req.message.guild, data)
+    lines = ["【あだ名一覧】"] + [f"- {name_of(uid)}: {nick}" for uid, nick in data.items()]
+    await send_myu(req.message, req.ctx, _clip_lines(lines))
 
-    # --- 変身コード待ち ---
-    if user_id in waiting_for_transform_code:
-        t_text = content_body
-        waiting_for_transform_code.discard(user_id)
-        
-        if "なのになってみて" in t_text:
-            if is_nanoka_unlocked(user_id):
-                set_user_form(user_id, "nanoka")
-                await send_myu(message, user_id, "今日から三月なのか/長夜月の姿になるわ♪ よろしくねっ！")
-            else:
-                await send_myu(message, user_id, "まだ条件が足りないみたい…。じゃんけんにいっぱい勝ってみて？")
-            return
-        if "たんたんになってみて" in t_text:
-            if is_danheng_unlocked(user_id):
-                set_user_form(user_id, "danheng")
-                await send_myu(message, user_id, "…わかった。丹恒の姿になろう。")
+@router.route(exact=["管理者編集"], guard=_in_admin_mode)
+async def route_admin_edit(req):
+    ids = sorted(db.load_admin_ids() | {PRIMARY_ADMIN_ID})
+    lines = ["【管理者一覧】"] + [f"- <@{uid}>" for uid in ids]
+    lines.append("\n追加するなら `管理者追加`、外すなら `管理者削除` って送ってね。")
+    await send_myu(req.message, req.ctx, _clip_lines(lines))
+
+@router.route(exact=["管理者追加"], guard=_in_admin_mode)
+async def route_admin_add(req):
+    SESSIONS.start(req.user_id, SessionState.ADMIN_ADD)
+    await send_myu(req.message, req.ctx, "管理者に追加する人を @メンション で教えてちょうだい。")
+
+@router.route(exact=["管理者削除"], guard=_in_admin_mode)
+async def route_admin_remove(req):
+    SESSIONS.start(req.user_id, SessionState.ADMIN_REMOVE)
+    await send_myu(req.message, req.ctx, "管理者から外す人を @メンション で教えてちょうだい。")
+
+@router.route(exact=["親衛隊レベル編集"], guard=_in_admin_mode)
+async def route_admin_guardian(req):
+    SESSIONS.start(req.user_id, SessionState.GUARDIAN_LEVEL)
+    await send_myu(req.message, req.ctx, "`@ユーザー レベル` で設定するわ（0 で削除よ）。")
+
+@router.route(prefix=["好感度編集"], guard=_in_admin_mode)
+async def route_admin_affection_config(req):
+    cfg = db.load_affection_config()
+    args = req.text[len("好感度編集"):].split()
+    if len(args) == 2 and args[1].lstrip("-").isdigit():
+        key, value = args[0], int(args[1])
+        m = re.fullmatch(r"(?i)lv\.?(\d+)", key)
+        try:
+            if m and 0 <= int(m.group(1)) < len(cfg.level_thresholds):
+                cfg = cfg.with_threshold(int(m.group(1)), value)
+            elif key in cfg.xp_actions:
+                cfg = cfg.with_action(key, value)
             else:
-                await send_myu(message, user_id, "鍵が足りないみたい。")
+                await send_myu(req.message, req.ctx, f"`{key}` は知らない項目みたい。")
+                return
+        except ValueError:
+            await send_myu(req.message, req.ctx, "必要XPは上のレベルほど大きくなるようにしてね。")
             return
-        
-        fk = resolve_form_code(t_text)
-        if fk:
-            set_user_form(user_id, fk)
-            await send_myu(message, user_id, f"**{get_form_display_name(fk)}** に変身したわ♪ どう？似合う？")
-        else:
-            await send_myu(message, user_id, "そのコードは知らないみたい…。もう一度確認してくれる？")
+        await db.save_affection_config(cfg)
+    th = " / ".join(f"Lv{i}:{v}" for i, v in enumerate(cfg.level_thresholds))
+    acts = " / ".join(f"{k}:{v}" for k, v in cfg.xp_actions.items())
+    await send_myu(req.message, req.ctx, (
+        "【好感度設定】\n"
+        f"- 必要XP: {th}\n"
+        f"- 獲得XP: {acts}\n"
+        "変更は `好感度編集 Lv3 4000` や `好感度編集 talk 5` の形でどうぞ♪"
+    ))
+
+@router.route(prefix=["好感度XP追加"], guard=_in_admin_mode)
+async def route_admin_add_xp(req):
+    target, amount = _parse_target(req)
+    if target is None or amount is None:
+        await send_myu(req.message, req.ctx, "`好感度XP追加 @ユーザー 数値` の形で教えてね。")
         return
+    logic.XP_ACCUMULATOR.add(target, amount)
+    await send_myu(req.message, req.ctx, f"<@{target}> に {amount} XP 追加したわ♪（現在 {logic.get_user_xp(target)} XP）")
 
-    # --- データ管理モード ---
-    if user_id in admin_data_mode:
-        if content_body == "データ管理終了":
-            admin_data_mode.discard(user_id)
-            await send_myu(message, user_id, "データ管理モード、終了ね。また必要になったら呼んでちょうだい♪")
-            return
-        
-        if content_body == "好感度一覧":
-            text = logic.format_all_affection_status(message.guild)
-            await send_myu(message, user_id, text)
-            return
+@router.route(prefix=["好感度一覧"], guard=_in_admin_mode)
+async def route_admin_affection_list(req):
+    m = re.search(r"\d+", req.text[len("好感度一覧"):])
+    page = int(m.group()) if m else 1
+    await send_myu(req.message, req.ctx, await logic.format_all_affection_status(req.message.guild, page))
 
-        # デフォルト案内
-        await send_myu(message, user_id, f"{ADMIN_COMMANDS_LIST}\n\nコマンドを待ってるわ。何をすればいいかしら？♪")
+@router.route(prefix=["じゃんけん勝利数追加"], guard=_in_admin_mode)
+async def route_admin_add_janken(req):
+    target, amount = _parse_target(req)
+    if target is None or amount is None:
+        await send_myu(req.message, req.ctx, "`じゃんけん勝利数追加 @ユーザー 数値` の形で教えてね。")
         return
-    
-    if content_body == "データ管理" and db.is_admin(user_id):
-        admin_data_mode.add(user_id)
-        await send_myu(message, user_id, f"データ管理モードに入ったわ。\n{ADMIN_COMMANDS_LIST}")
+    state = special_unlocks.get_unlock_state(target)
+    state["janken_wins"] = max(0, int(state.get("janken_wins", 0)) + amount)
+    special_unlocks.save_unlock_state(target, state)
+    await send_myu(req.message, req.ctx, f"<@{target}> のじゃんけん勝利数を {state['janken_wins']} にしたわ。")
+
+@router.route(exact=["メッセージ制限編集"], guard=_in_admin_mode)
+async def route_admin_msg_limit(req):
+    SESSIONS.start(req.user_id, SessionState.MSG_LIMIT, {"mode": "limit"})
+    await send_myu(req.message, req.ctx, "`@ユーザー 回数` で1日の上限を設定するわ（0 で解除よ）。")
+
+@router.route(exact=["メッセージ制限bypass編集"], guard=_in_primary_admin_mode)
+async def route_admin_msg_bypass(req):
+    cfg = db.load_message_limit_config()
+    SESSIONS.start(req.user_id, SessionState.MSG_LIMIT, {"mode": "bypass"})
+    state = "有効" if cfg.bypass_enabled else "無効"
+    users = ", ".join(f"<@{u}>" for u in sorted(cfg.bypass_users)) or "なし"
+    await send_myu(req.message, req.ctx, (
+        f"今の bypass は {state} よ。対象: {users}\n"
+        "`有効` / `無効` / `追加 @ユーザー` / `削除 @ユーザー` で変更できるわ。"
+    ))
+
+@router.route(prefix=["変身管理"], guard=_in_admin_mode)
+async def route_admin_forms(req):
+    target, _ = _parse_target(req)
+    spec = re.sub(r"<@!?\d+>|\d{15,20}", " ", req.text[len("変身管理"):]).strip()
+    if target is not None and spec:
+        fk = resolve_form_spec(spec)
+        if not fk:
+            await send_myu(req.message, req.ctx, f"`{spec}` はどの姿かわからないみたい。")
+            return
+        if target == req.user_id: req.ctx.set_form(fk)
+        else: set_user_form(target, fk)
+        await send_myu(req.message, req.ctx, f"<@{target}> を **{get_form_display_name(fk)}** にしたわ♪")
         return
+    guild_id = req.message.guild.id if req.message.guild else None
+    data = get_all_forms(guild_id)
+    name_of = await _member_names(req.message.guild, data)
+    # 一括変身は記録のない人にも効くので、個別の行とは別に1行で出す
+    bulk = get_form_overrides(guild_id)
+    lines = ["【変身状況】"]
+    lines += [f"- {label}: {get_form_display_name(bulk[scope])}" for scope, label in (("global", "全体"), ("guild", "このサーバー")) if scope in bulk]
+    lines += [f"- {name_of(uid)}: {get_form_display_name(fk)}" for uid, fk in data.items()]
+    lines.append("\n`変身管理 @ユーザー 姿（コード/名前）` で変身させられるわ。")
+    await send_myu(req.message, req.ctx, _clip_lines(lines))
 
-    # --- あだ名系 ---
-    if content_body.startswith("あだ名登録"):
-        new = content_body.replace("あだ名登録", "", 1).strip()
-        if not new:
-            waiting_for_nickname.add(user_id)
-            await send_myu(message, user_id, rs.get_nickname_message_for_form(current_form, "ask"))
-        else:
-            db.set_nickname(user_id, new)
-            await send_myu(message, user_id, rs.get_nickname_message_for_form(current_form, "confirm", new))
+@router.route(prefix=["一括変身"], guard=_in_admin_mode)
+async def route_admin_forms_all(req):
+    spec = req.text[len("一括変身"):].strip()
+    guild_id = None
+    if spec.startswith("サーバー"):
+        if req.message.guild is None:
+            await send_myu(req.message, req.ctx, "サーバーの中で使ってね。")
+            return
+        spec, guild_id = spec[len("サーバー"):].strip(), req.message.guild.id
+    fk = resolve_form_spec(spec)
+    if not fk:
+        await send_myu(req.message, req.ctx, "`一括変身 姿` で全員、`一括変身 サーバー 姿` でこのサーバーの全員を変身させられるわ。")
         return
+    set_all_forms(fk, guild_id)
+    where = "このサーバーのみんな" if guild_id is not None else "みんな"
+    await send_myu(req.message, req.ctx, f"{where}を **{get_form_display_name(fk)}** にしたわ♪（あとで自分で変身した人はそのままよ）")
 
-    if user_id in waiting_for_nickname:
-        if content_body:
-            db.set_nickname(user_id, content_body)
-            waiting_for_nickname.discard(user_id)
-            await send_myu(message, user_id, rs.get_nickname_message_for_form(current_form, "confirm", content_body))
-        else:
-            await send_myu(message, user_id, "聞こえなかったわ、もう一度教えてくれる？")
+@router.route(exact=["変身解放状況確認"], guard=_in_primary_admin_mode)
+async def route_admin_unlocks(req):
+    data = special_unlocks.load_unlock_data()
+    if not data:
+        await send_myu(req.message, req.ctx, "まだ解放データは誰もないみたい。")
         return
+    name_of = await _member_names(req.message.guild, data)
+    lines = ["【変身解放状況】"]
+    for uid, st in data.items():
+        flags = [label for key, label in (("nanoka_unlocked", "なのか"), ("danheng_stage1", "荒笛"), ("danheng_unlocked", "丹恒")) if st.get(key)]
+        lines.append(f"- {name_of(uid)}: 勝利 {st.get('janken_wins', 0)} / {'・'.join(flags) or '未解放'}")
+    await send_myu(req.message, req.ctx, _clip_lines(lines))
 
-    # --- ガチャ ---
-    if "ガチャ" in content_body:
-        if "単発" in content_body:
-            ok, res = logic.perform_gacha_pulls(user_id, 1)
-            await send_myu(message, user_id, res)
-        elif "10連" in content_body or "１０連" in content_body:
-            use_ticket = "チケット" in content_body
-            ok, res = logic.perform_gacha_pulls(user_id, 10, use_ticket)
-            await send_myu(message, user_id, res)
-        else:
-            await send_myu(message, user_id, logic.format_gacha_status(user_id)) 
+# --- データ管理モード：入力待ち ---
+@router.route(state=SessionState.ADMIN_ADD)
+async def route_admin_add_target(req):
+    target, _ = _parse_target(req)
+    if target is None:
+        await send_myu(req.message, req.ctx, "追加する人を @メンション で教えてちょうだい。")
         return
+    SESSIONS.start(req.user_id, SessionState.ADMIN)
+    db.add_admin(target)
+    await send_myu(req.message, req.ctx, f"<@{target}> を管理者に追加したわ♪")
 
-    if "デイリー" in content_body:
-        ok, stones, reason = logic.grant_daily_stones(user_id)
-        await send_myu(message, user_id, f"{reason}\n所持石: {stones}")
+@router.route(state=SessionState.ADMIN_REMOVE)
+async def route_admin_remove_target(req):
+    target, _ = _parse_target(req)
+    if target is None:
+        await send_myu(req.message, req.ctx, "外す人を @メンション で教えてちょうだい。")
         return
+    SESSIONS.start(req.user_id, SessionState.ADMIN)
+    if db.remove_admin(target):
+        await send_myu(req.message, req.ctx, f"<@{target}> を管理者から外したわ。")
+    else:
+        await send_myu(req.message, req.ctx, "その人は外せないみたい（管理者じゃないか、メイン管理者よ）。")
 
-    # --- 変身開始 ---
-    if content_body == "変身":
-        waiting_for_transform_code.add(user_id)
-        await send_myu(message, user_id, "ふふっ、別の姿になりたいの？ 変身コードを教えてくれるかしら♪")
+@router.route(state=SessionState.GUARDIAN_LEVEL)
+async def route_guardian_level_input(req):
+    target, level = _parse_target(req)
+    if target is None or level is None:
+        await send_myu(req.message, req.ctx, "`@ユーザー レベル` の形で教えてね（0 で削除よ）。")
         return
+    SESSIONS.start(req.user_id, SessionState.ADMIN)
+    if level <= 0:
+        db.delete_guardian_level(target)
+        await send_myu(req.message, req.ctx, f"<@{target}> の親衛隊レベルを削除したわ。")
+    else:
+        db.set_guardian_level(target, level)
+        await send_myu(req.message, req.ctx, f"<@{target}> の親衛隊レベルを Lv.{level} にしたわ♪")
 
-    # --- じゃんけん ---
-    if "じゃんけん" in content_body or user_id in waiting_for_rps_choice:
-        hand = logic.parse_hand(content_body)
-        
-        # 手が入力されていない場合 -> 開始
-        if not hand and "じゃんけん" in content_body:
-            waiting_for_rps_choice.add(user_id)
-            # ★修正: rs.get_rps_prompt_for_form を使用
-            prompt = rs.get_rps_prompt_for_form(current_form, name)
-            await send_myu(message, user_id, prompt)
-            return
-        
-        # 手が入力された場合
-        if hand:
-            force = user_id in FORCE_RPS_WIN_NEXT
-            bot_hand = logic.get_bot_hand(hand, force)
-            res = "win" if force else logic.judge_janken(hand, bot_hand)
-            if force: FORCE_RPS_WIN_NEXT.discard(user_id)
-            
-            wins = inc_janken_win(user_id) if res == "win" else get_janken_wins(user_id)
-            
-            result_msg = rs.format_rps_result(current_form, name, hand, bot_hand, rs.get_rps_flavor(current_form, res, name), wins)
-            
-            await send_myu(message, user_id, result_msg)
-            
-            xp_map = {"win": 10, "lose": 5, "draw": 7}
-            logic.add_affection_xp(user_id, xp_map.get(res, 0))
-            waiting_for_rps_choice.discard(user_id)
+@router.route(state=SessionState.MSG_LIMIT)
+async def route_msg_limit_input(req):
+    mode = req.session.payload.get("mode")
+    target, value = _parse_target(req)
+    if mode == "limit":
+        if target is None or value is None:
+            await send_myu(req.message, req.ctx, "`@ユーザー 回数` の形で教えてね（0 で制限解除よ）。")
             return
-
-    # --- 親衛隊レベル確認 ---
-    if content_body in ["親衛隊レベル", "親衛隊レベル確認"]:
-        lv = db.get_guardian_level(user_id)
-        msg = f"あなたの親衛隊レベルは Lv.{lv} よ♪" if lv else "まだ親衛隊レベルは登録されてないみたいね。"
-        await send_myu(message, user_id, msg)
+        SESSIONS.start(req.user_id, SessionState.ADMIN)
+        db.set_message_limit(target, value)
+        msg = f"<@{target}> の制限を解除したわ。" if value <= 0 else f"<@{target}> は1日 {value} 回までにしたわ。"
+        await send_myu(req.message, req.ctx, msg)
         return
 
-    # --- 好感度チェック ---
-    if content_body in ["好感度", "好感度チェック", "キュレネ好感度"]:
-        msg = logic.get_affection_status_message(user_id)
-        await send_myu(message, user_id, f"{message.author.mention} {msg}")
+    # bypass 設定
+    cfg = db.load_message_limit_config()
+    if req.text in ["有効", "オン"]: cfg = replace(cfg, bypass_enabled=True)
+    elif req.text in ["無効", "オフ"]: cfg = replace(cfg, bypass_enabled=False)
+    elif req.text.startswith("追加") and target is not None: cfg = replace(cfg, bypass_users=cfg.bypass_users | {str(target)})
+    elif req.text.startswith("削除") and target is not None: cfg = replace(cfg, bypass_users=cfg.bypass_users - {str(target)})
+    else:
+        await send_myu(req.message, req.ctx, "`有効` / `無効` / `追加 @ユーザー` / `削除 @ユーザー` のどれかで教えてね。")
         return
+    SESSIONS.start(req.user_id, SessionState.ADMIN)
+    await db.save_message_limit_config(cfg)
+    state = "有効" if cfg.bypass_enabled else "無効"
+    await send_myu(req.message, req.ctx, f"bypass 設定を更新したわ。（{state} / 対象 {len(cfg.bypass_users)} 人）")
+
+@router.route(state=ADMIN_STATES)
+async def route_admin_default(req):
+    # 管理モード中は知らないコマンドでも案内だけ返す
+    await send_myu(req.message, req.ctx, f"{ADMIN_COMMANDS_LIST}\n\nコマンドを待ってるわ。何をすればいいかしら？♪")
+
+@router.route(exact=["データ管理"], guard=_is_admin)
+async def route_admin_enter(req):
+    SESSIONS.start(req.user_id, SessionState.ADMIN)
+    await send_myu(req.message, req.ctx, f"データ管理モードに入ったわ。\n{ADMIN_COMMANDS_LIST}")
+
+# --- あだ名系 ---
+@router.route(prefix=["あだ名登録"])
+async def route_nickname_register(req):
+    ctx = req.ctx
+    new = req.text.replace("あだ名登録", "", 1).strip()
+    if not new:
+        SESSIONS.start(req.user_id, SessionState.NICKNAME)
+        await send_myu(req.message, ctx, rs.get_nickname_message_for_form(ctx.form, "ask"))
+    else:
+        ctx.set_nickname(new)
+        await send_myu(req.message, ctx, rs.get_nickname_message_for_form(ctx.form, "confirm", new))
+
+@router.route(state=SessionState.NICKNAME)
+async def route_nickname_input(req):
+    ctx = req.ctx
+    if req.text:
+        ctx.set_nickname(req.text)
+        SESSIONS.end(req.user_id)
+        await send_myu(req.message, ctx, rs.get_nickname_message_for_form(ctx.form, "confirm", req.text))
+    else:
+        await send_myu(req.message, ctx, "聞こえなかったわ、もう一度教えてくれる？")
 
-    # --- 変身状態確認 ---
-    if content_body in ["変身状態", "今の姿", "今のフォーム"]:
-        fname = get_form_display_name(current_form)
-        await send_myu(message, user_id, f"{message.author.mention} 今のあたしは **{fname}** よ♪")
+# --- ガチャ ---
+@router.route(contains=["ガチャ"])
+async def route_gacha(req):
+    ctx, text = req.ctx, req.text
+    bulk = gacha_engine.parse_bulk_request(text)
+    if bulk:
+        ok, res = gacha_engine.perform_bulk_pulls(ctx, bulk)
+        await send_myu(req.message, ctx, res)
+    elif "単発" in text:
+        ok, res = logic.perform_gacha_pulls(ctx, 1)
+        await send_myu(req.message, ctx, res)
+    elif "10連" in text or "１０連" in text:
+        use_ticket = "チケット" in text
+        ok, res = logic.perform_gacha_pulls(ctx, 10, use_ticket)
+        await send_myu(req.message, ctx, res)
+    else:
+        await send_myu(req.message, ctx, logic.format_gacha_status(ctx))
+
+@router.route(contains=["デイリー"])
+async def route_daily(req):
+    ok, stones, reason = logic.grant_daily_stones(req.ctx)
+    await send_myu(req.message, req.ctx, f"{reason}\n所持石: {stones}")
+
+# --- 変身開始 ---
+@router.route(exact=["変身"])
+async def route_transform(req):
+    SESSIONS.start(req.user_id, SessionState.TRANSFORM_CODE)
+    await send_myu(req.message, req.ctx, "ふふっ、別の姿になりたいの？ 変身コードを教えてくれるかしら♪")
+
+# --- じゃんけん ---
+@router.route(contains=["じゃんけん"], state=SessionState.RPS_CHOICE)
+async def route_janken(req):
+    message, ctx, user_id = req.message, req.ctx, req.user_id
+    hand = logic.parse_hand(req.text)
+
+    # 手が入力されていない場合 -> 開始
+    if not hand and "じゃんけん" in req.text:
+        SESSIONS.start(user_id, SessionState.RPS_CHOICE)
+        prompt = rs.get_rps_prompt_for_form(ctx.form, ctx.name)
+        await send_myu(message, ctx, prompt)
         return
 
-    # --- 通常会話 ---
-    xp, lv = logic.get_user_affection(user_id)
-    reply = rs.generate_reply_for_form(current_form, content_body, lv, user_id, name)
-    
-    if current_form == "cyrene" and ARAFUE_TRIGGER_LINE in reply:
-        mark_danheng_stage1(user_id)
-    
-    if "記憶は流れ星を待ってる" in content_body and get_janken_wins(user_id) >= 307 and not is_nanoka_unlocked(user_id):
-        set_nanoka_unlocked(user_id, True)
+    # 手が入力されていなければ、ほかのコマンド / 通常会話へ回す
+    if not hand:
+        return False
+
+    force = user_id in FORCE_RPS_WIN_NEXT
+    bot_hand = logic.get_bot_hand(hand, force)
+    res = "win" if force else logic.judge_janken(hand, bot_hand)
+    if force: FORCE_RPS_WIN_NEXT.discard(user_id)
+
+    wins = ctx.inc_janken_win() if res == "win" else ctx.janken_wins
+    result_msg = rs.format_rps_result(ctx.form, ctx.name, hand, bot_hand, rs.get_rps_flavor(ctx.form, res, ctx.name), wins)
+    await send_myu(message, ctx, result_msg)
+
+    logic.add_affection_xp(ctx, ctx.affection_config.xp_for(f"rps_{res}"))
+    SESSIONS.end(user_id, SessionState.RPS_CHOICE)
+
+# --- 親衛隊レベル確認 ---
+@router.route(exact=["親衛隊レベル", "親衛隊レベル確認"])
+async def route_guardian_level(req):
+    lv = db.get_guardian_level(req.user_id)
+    msg = f"あなたの親衛隊レベルは Lv.{lv} よ♪" if lv else "まだ親衛隊レベルは登録されてないみたいね。"
+    await send_myu(req.message, req.ctx, msg)
+
+# --- 好感度チェック ---
+@router.route(exact=["好感度", "好感度チェック", "キュレネ好感度"])
+async def route_affection(req):
+    msg = logic.get_affection_status_message(req.ctx)
+    await send_myu(req.message, req.ctx, f"{req.mention} {msg}")
+
+# --- 変身状態確認 ---
+@router.route(exact=["変身状態", "今の姿", "今のフォーム"])
+async def route_form_status(req):
+    fname = get_form_display_name(req.ctx.form)
+    await send_myu(req.message, req.ctx, f"{req.mention} 今のあたしは **{fname}** よ♪")
+
+# --- 通常会話 ---
+@router.fallback
+async def route_chat(req):
+    ctx, content_body = req.ctx, req.text
+    reply = rs.generate_reply_for_form(ctx, content_body)
+
+    if ctx.form == "cyrene" and ARAFUE_TRIGGER_LINE in reply:
+        ctx.set_unlock("danheng_stage1", True)
+
+    if "記憶は流れ星を待ってる" in content_body and ctx.janken_wins >= 307 and not ctx.unlocks.get("nanoka_unlocked"):
+        ctx.set_unlock("nanoka_unlocked", True)
         reply += "\n\n【三月なのか 解放！】『なのになってみて』と言ってみて？"
 
-    await send_myu(message, user_id, f"{message.author.mention} {reply}")
-    logic.add_affection_xp(user_id, 3)
+    await send_myu(req.message, ctx, f"{req.mention} {reply}")
+    logic.add_affection_xp(ctx, ctx.affection_config.xp_for("talk", 3))
 
-client.run(DISCORD_TOKEN)
\ No newline at end of file
+try:
+    client.run(DISCORD_TOKEN)
+finally:
+    # 定期フラッシュの書き出しが残っていれば先に終わらせてから、最後の書き出し
+    storage.close()
+    logic.XP_ACCUMULATOR.flush()
+    QUOTA.flush()
+    storage.flush_all(compact=True)
+    SESSIONS.save(SESSIONS_FILE)
\ No newline at end of file
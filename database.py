@@ -1,48 +1,35 @@
 # database.py
-import json
-from pathlib import Path
+from storage import get_store
+import overrides
+from settings import AFFECTION_CONFIG, MESSAGE_LIMIT_CONFIG
 from config import (
     NICKNAMES_FILE, ADMINS_FILE, GUARDIAN_FILE, AFFECTION_FILE,
-    AFFECTION_CONFIG_FILE, MESSAGE_LIMIT_FILE, MESSAGE_USAGE_FILE,
-    MESSAGE_LIMIT_CONFIG_FILE, GACHA_FILE, MYURION_FILE,
+    MESSAGE_LIMIT_FILE, MESSAGE_USAGE_FILE, GACHA_FILE, MYURION_FILE,
     PRIMARY_ADMIN_ID, today_str
 )
 
-# --- 共通ユーティリティ ---
-def _load_json(path: Path, default=None):
-    if default is None: default = {}
-    if not path.exists(): return default
-    try:
-        data = json.loads(path.read_text(encoding="utf-8"))
-        # もし読み込んだ型がデフォルトと違う（リスト期待なのに辞書など）場合はデフォルトを返す
-        if isinstance(default, list) and not isinstance(data, list): return default
-        if isinstance(default, dict) and not isinstance(data, dict): return default
-        return data
-    except Exception:
-        return default
-
-def _save_json(path: Path, data):
-    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+# --- ストア（storage.py のキャッシュ。読み取りはメモリ、書き込みは遅延フラッシュ） ---
+_nicknames = get_store(NICKNAMES_FILE)
+_admins = get_store(ADMINS_FILE, list)
+_guardian = get_store(GUARDIAN_FILE)
+_affection = get_store(AFFECTION_FILE)
+_message_limits = get_store(MESSAGE_LIMIT_FILE)
+_message_usage = get_store(MESSAGE_USAGE_FILE)
+_gacha = get_store(GACHA_FILE)
+_myurion = get_store(MYURION_FILE)
 
 # --- あだ名 ---
-def load_nicknames(): return _load_json(NICKNAMES_FILE, {})
-def set_nickname(user_id, nickname):
-    data = load_nicknames()
-    data[str(user_id)] = nickname
-    _save_json(NICKNAMES_FILE, data)
-def get_nickname(user_id): return load_nicknames().get(str(user_id))
-def delete_nickname(user_id):
-    data = load_nicknames()
-    if str(user_id) in data:
-        del data[str(user_id)]
-        _save_json(NICKNAMES_FILE, data)
+def load_nicknames(): return _nicknames.all()
+def set_nickname(user_id, nickname): _nicknames.set(str(user_id), nickname)
+def get_nickname(user_id): return _nicknames.get(str(user_id))
+def delete_nickname(user_id): _nicknames.delete(str(user_id))
 
 # --- 管理者 ---
-def load_admin_ids(): return set(_load_json(ADMINS_FILE, []))
-def save_admin_ids(id_set): _save_json(ADMINS_FILE, list(id_set))
+def load_admin_ids(): return set(_admins.all())
+def save_admin_ids(id_set): _admins.replace(list(id_set))
 def is_admin(user_id):
     if user_id == PRIMARY_ADMIN_ID: return True
-    return user_id in load_admin_ids()
+    return user_id in _admins.all()
 def add_admin(user_id):
     if user_id == PRIMARY_ADMIN_ID: return
     ids = load_admin_ids()
@@ -58,118 +45,138 @@ def remove_admin(user_id):
     return False
 
 # --- 親衛隊レベル ---
-def load_guardian_levels(): return _load_json(GUARDIAN_FILE, {})
-def set_guardian_level(user_id, level):
-    data = load_guardian_levels()
-    data[str(user_id)] = int(level)
-    _save_json(GUARDIAN_FILE, data)
-def get_guardian_level(user_id): return load_guardian_levels().get(str(user_id))
-def delete_guardian_level(user_id):
-    data = load_guardian_levels()
-    if str(user_id) in data:
-        del data[str(user_id)]
-        _save_json(GUARDIAN_FILE, data)
+def load_guardian_levels(): return _guardian.all()
+def set_guardian_level(user_id, level): _guardian.set(str(user_id), int(level))
+def get_guardian_level(user_id): return _guardian.get(str(user_id))
+def delete_guardian_level(user_id): _guardian.delete(str(user_id))
 
 # --- 好感度 ---
-DEFAULT_AFFECTION_CONFIG = {
-    "level_thresholds": [0, 0, 1000, 4000, 16000, 640000, 33350337],
-    "xp_actions": {"talk": 3, "rps_win": 10, "rps_lose": 5, "rps_draw": 7},
-}
-def load_affection_data(): return _load_json(AFFECTION_FILE, {})
-def save_affection_data(data): _save_json(AFFECTION_FILE, data)
-def load_affection_config(): 
-    cfg = _load_json(AFFECTION_CONFIG_FILE, DEFAULT_AFFECTION_CONFIG.copy())
-    # マージ
-    base = DEFAULT_AFFECTION_CONFIG.copy()
-    base.update(cfg)
-    return base
-def save_affection_config(cfg): _save_json(AFFECTION_CONFIG_FILE, cfg)
+# XP を直接書き換えたときに呼ぶ関数 func(user_id)（丸ごと差し替えたときは user_id=None）。
+# logic のランキング索引がこれで差し直し・作り直しをする（database からは logic を import できないため）
+_affection_watchers = []
+def watch_affection(func): _affection_watchers.append(func)
+def _notify_affection(user_id=None):
+    for func in _affection_watchers: func(user_id)
+
+def load_affection_data(): return _affection.all()
+def save_affection_data(data):
+    _affection.replace(data)
+    _notify_affection()
+def get_affection_xp(user_id):
+    info = _affection.get(str(user_id), {})
+    return int(info.get("xp", 0))
+def set_affection_xp(user_id, xp):
+    key = str(user_id)
+    info = _affection.get(key, {})
+    info["xp"] = int(xp)
+    _affection.set(key, info)
+    _notify_affection(user_id)
+def increment_affection_xp(user_id, delta):
+    return _affection.incr(str(user_id), "xp", int(delta), minimum=0)
+# 設定は settings.AffectionConfig（読み取り専用。変えるときは新しいものを save する）
+def load_affection_config(): return AFFECTION_CONFIG.get()
+async def save_affection_config(cfg): await AFFECTION_CONFIG.save(cfg)
 
 # --- メッセージ制限 ---
-DEFAULT_MSG_LIMIT_CONFIG = {"bypass_enabled": False, "allow_bypass_grant": False, "bypass_users": []}
-def load_message_limits(): return _load_json(MESSAGE_LIMIT_FILE, {})
+def load_message_limits(): return _message_limits.all()
 def set_message_limit(user_id, limit):
-    data = load_message_limits()
-    if limit is None or limit <= 0: data.pop(str(user_id), None)
-    else: data[str(user_id)] = int(limit)
-    _save_json(MESSAGE_LIMIT_FILE, data)
-def get_message_limit(user_id): return load_message_limits().get(str(user_id))
+    if limit is None or limit <= 0: _message_limits.delete(str(user_id))
+    else: _message_limits.set(str(user_id), int(limit))
+def get_message_limit(user_id): return _message_limits.get(str(user_id))
 def delete_message_limit(user_id): set_message_limit(user_id, 0)
 
-def load_message_usage(): return _load_json(MESSAGE_USAGE_FILE, {})
+# 回数のカウントは quota.QUOTA（メモリ上で数えて、まとめて書き戻す）
+def load_message_usage(): return _message_usage.all()
+def set_message_usage(user_id, date, count): _message_usage.set(str(user_id), {"date": date, "count": int(count)})
 def get_message_usage(user_id):
-    data = load_message_usage()
-    info = data.get(str(user_id), {})
-    today = today_str()
-    if info.get("date") != today: return today, 0
-    return today, info.get("count", 0)
+    from quota import QUOTA
+    return today_str(), QUOTA.usage(user_id)
 def increment_message_usage(user_id):
-    data = load_message_usage()
-    today = today_str()
-    info = data.get(str(user_id), {})
-    if info.get("date") != today:
-        info = {"date": today, "count": 1}
-    else:
-        info["count"] = info.get("count", 0) + 1
-    data[str(user_id)] = info
-    _save_json(MESSAGE_USAGE_FILE, data)
-    return info["count"]
-
-def load_message_limit_config(): 
-    return _load_json(MESSAGE_LIMIT_CONFIG_FILE, DEFAULT_MSG_LIMIT_CONFIG.copy())
-def save_message_limit_config(cfg): _save_json(MESSAGE_LIMIT_CONFIG_FILE, cfg)
+    from quota import QUOTA
+    QUOTA.consume(user_id)
+    return QUOTA.usage(user_id)
+
+# 設定は settings.MessageLimitConfig（読み取り専用）
+def load_message_limit_config(): return MESSAGE_LIMIT_CONFIG.get()
+async def save_message_limit_config(cfg): await MESSAGE_LIMIT_CONFIG.save(cfg)
 
 def can_bypass_message_limit(user_id):
     if is_admin(user_id): return True
-    cfg = load_message_limit_config()
-    if not cfg.get("bypass_enabled", False): return False
-    return str(user_id) in cfg.get("bypass_users", [])
+    return load_message_limit_config().can_bypass(user_id)
 
 def is_over_message_limit(user_id):
-    limit = get_message_limit(user_id)
-    if limit is None or limit <= 0: return False
-    _, count = get_message_usage(user_id)
-    return count >= limit
+    from quota import QUOTA
+    return QUOTA.is_over(user_id)
 
 # --- ガチャ ---
-def load_gacha_data(): return _load_json(GACHA_FILE, {})
-def save_gacha_data(data): _save_json(GACHA_FILE, data)
-def get_gacha_state(user_id):
-    data = load_gacha_data()
-    state = data.get(str(user_id))
+def load_gacha_data(): return _gacha.all()
+def save_gacha_data(data): _gacha.replace(data)
+def get_gacha_state(user_id, create=True):
+    # create=False なら未登録ユーザーでも保存はせず初期状態だけ返す
+    state = _gacha.get(str(user_id))
     if not isinstance(state, dict):
         state = {
             "stones": 0, "pity_5": 0, "pity_4": 0, "guaranteed_cyrene": False,
             "cyrene_copies": 0, "page1_count": 0, "offbanner_tickets": 0, "last_daily": None,
         }
-        data[str(user_id)] = state
-        _save_json(GACHA_FILE, data)
+        if create: _gacha.set(str(user_id), state)
     return state
-def save_gacha_state(user_id, state):
-    data = load_gacha_data()
-    data[str(user_id)] = state
-    _save_json(GACHA_FILE, data)
+def save_gacha_state(user_id, state): _gacha.set(str(user_id), state)
 
 # --- ミュリオン ---
-def load_myurion_data(): return _load_json(MYURION_FILE, {})
-def save_myurion_data(data): _save_json(MYURION_FILE, data)
-def get_myurion_state(user_id):
-    data = load_myurion_data()
-    st = data.get(str(user_id))
+# 送信のたびに「ミュリオンモードか」を見るので、個別の設定を {user_id: (enabled, 設定時刻)} でメモリに持っておく
+# （初回参照時にストアから作り、save_myurion_state で更新する。一度もオンにしていない人は載せない）。
+# 「全体ミュリオンモード」などの一括切り替えは overrides の上書き設定1件で表す。
+_myurion_enabled_ids = None
+
+def _index_entry(st):
+    if not isinstance(st, dict) or not (st.get("enabled") or st.get("at")): return None
+    return (bool(st.get("enabled")), float(st.get("at", 0)))
+
+def _myurion_index() -> dict:
+    global _myurion_enabled_ids
+    if _myurion_enabled_ids is None:
+        _myurion_enabled_ids = {}
+        for uid, st in _myurion.all().items():
+            entry = _index_entry(st)
+            if entry is not None and str(uid).isdigit():
+                _myurion_enabled_ids[int(uid)] = entry
+    return _myurion_enabled_ids
+
+def load_myurion_data(): return _myurion.all()
+def save_myurion_data(data):
+    global _myurion_enabled_ids
+    _myurion.replace(data)
+    _myurion_enabled_ids = None
+def get_myurion_state(user_id, create=True):
+    st = _myurion.get(str(user_id))
     if not isinstance(st, dict):
         st = {"unlocked": False, "enabled": False, "quiz_correct": 0}
-        data[str(user_id)] = st
-        _save_json(MYURION_FILE, data)
+        if create: _myurion.set(str(user_id), st)
     return st
 def save_myurion_state(user_id, st):
-    data = load_myurion_data()
-    data[str(user_id)] = st
-    _save_json(MYURION_FILE, data)
-def set_all_myurion_enabled(enabled: bool):
-    data = load_myurion_data()
-    for uid, st in data.items():
-        if not isinstance(st, dict): st = {}
-        st["enabled"] = bool(enabled)
-        if enabled: st["unlocked"] = True
-        data[uid] = st
-    _save_json(MYURION_FILE, data)
\ No newline at end of file
+    _myurion.set(str(user_id), st)
+    entry = _index_entry(st)
+    if entry is not None: _myurion_index()[int(user_id)] = entry
+    else: _myurion_index().pop(int(user_id), None)
+def set_myurion_enabled(st: dict, enabled: bool) -> None:
+    """本人による切り替え。設定時刻を付けるので、それより前の一括設定より優先される"""
+    st["enabled"] = bool(enabled)
+    st["at"] = overrides.now()
+def resolve_myurion_enabled(st: dict, guild_id=None) -> bool:
+    return bool(overrides.resolve("myurion", bool(st.get("enabled")), float(st.get("at", 0)), guild_id))
+def is_myurion_enabled(user_id, guild_id=None) -> bool:
+    """送信時の判定用。メモリ上の索引と上書き設定を見るだけで、ストアには触れない"""
+    enabled, at = _myurion_index().get(int(user_id), (False, 0.0))
+    return bool(overrides.resolve("myurion", enabled, at, guild_id))
+def is_myurion_unlocked(st: dict, guild_id=None) -> bool:
+    """本人がクイズで解放したか、全体 / サーバーのミュリオンモードONで解放されたか"""
+    if st.get("unlocked"): return True
+    return bool(overrides.resolve("myurion_unlocked", False, 0.0, guild_id))
+def set_all_myurion_enabled(enabled: bool, guild_id=None):
+    """
+    全員（guild_id を渡せばそのサーバーの全員）のミュリオンモードを切り替える。レコードは書き換えない。
+    ON にしたときは全員を解放済みにもする（あとで OFF にしても解放はそのまま）。
+    """
+    overrides.set_override("myurion", bool(enabled), guild_id)
+    if enabled: overrides.set_override("myurion_unlocked", True, guild_id)
@@ -1,14 +1,15 @@
 # forms.py
-import json
-from pathlib import Path
+from storage import get_store
+from config import FORMS_FILE
+import overrides
 
 # 変身状態（黄金裔 / 開拓者）を管理するためのモジュール。
 # - 保存先: /data/forms.json
 # - form_key: 英字のキー（例: "cyrene", "aglaia", "nanoka" など）
+# - 値は {"form": form_key, "at": 設定時刻}（古い形式の form_key だけの文字列も読める）
+# - 一括変身は overrides の上書き設定で表し、設定時刻の新しい方を使う
 
-DATA_DIR = Path("/data")
-DATA_DIR.mkdir(parents=True, exist_ok=True)
-FORMS_FILE = DATA_DIR / "forms.json"
+_forms = get_store(FORMS_FILE)
 
 # 利用可能なフォームのキーと表示名
 FORM_DISPLAY_NAMES = {
@@ -71,33 +72,30 @@ FORM_NAME_ALIASES = {
 VALID_FORM_KEYS = set(FORM_DISPLAY_NAMES.keys())
 
 
+def _unpack(value):
+    """保存値から (form_key, 設定時刻) を取り出す"""
+    if isinstance(value, dict):
+        return value.get("form"), float(value.get("at", 0))
+    return value, 0.0
+
+
 def load_forms() -> dict:
     """保存されているフォーム情報を読み込む {user_id(str): form_key}"""
-    if not FORMS_FILE.exists():
-        return {}
-    try:
-        data = json.loads(FORMS_FILE.read_text(encoding="utf-8"))
-        if not isinstance(data, dict):
-            return {}
-        return data
-    except Exception:
-        return {}
+    return {uid: _unpack(v)[0] for uid, v in _forms.all().items()}
 
 
 def save_forms(data: dict):
-    FORMS_FILE.write_text(
-        json.dumps(data, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    _forms.replace({uid: {"form": fk, "at": overrides.now()} for uid, fk in data.items()})
 
 
-def get_user_form(user_id: int) -> str:
+def get_user_form(user_id: int, guild_id=None) -> str:
     """
     指定ユーザーのフォームキーを取得。
-    保存されていない場合は 'cyrene'（キュレネ）を返す。
+    一括変身（全体 / サーバー）のあとに本人が変えていなければ、一括変身の方を返す。
+    どちらもない場合は 'cyrene'（キュレネ）を返す。
     """
-    data = load_forms()
-    key = data.get(str(user_id))
+    key, at = _unpack(_forms.get(str(user_id)))
+    key = overrides.resolve("form", key, at, guild_id)
     if key in VALID_FORM_KEYS:
         return key
     return "cyrene"
@@ -110,27 +108,43 @@ def set_user_form(user_id: int, form_key: str):
     """
     if form_key not in VALID_FORM_KEYS:
         form_key = "cyrene"
-    data = load_forms()
-    data[str(user_id)] = form_key
-    save_forms(data)
+    _forms.set(str(user_id), {"form": form_key, "at": overrides.now()})
+
+
+def get_all_forms(guild_id=None) -> dict:
+    """
+    記録のある全ユーザーのフォーム dict を返す。
+    get_user_form と同じく、一括変身（全体 / サーバー）の方が新しければそちらを返す。
+    """
+    out = {}
+    for uid, v in _forms.all().items():
+        key = overrides.resolve("form", *_unpack(v), guild_id)
+        out[uid] = key if key in VALID_FORM_KEYS else "cyrene"
+    return out
 
 
-def get_all_forms() -> dict:
-    """全ユーザーのフォーム dict を返す。"""
-    return load_forms()
+def get_form_overrides(guild_id=None) -> dict:
+    """
+    いま置かれている一括変身 {"global": form_key, "guild": form_key}（ないものは含めない）。
+    一括変身はレコードを書き換えないので、記録のないユーザーの分は get_all_forms に出てこない。
+    """
+    out = {}
+    for scope, scope_id in (("global", None), ("guild", guild_id)):
+        if scope == "guild" and guild_id is None: continue
+        item = overrides.get_override("form", scope_id)
+        if item is not None and item[0] in VALID_FORM_KEYS:
+            out[scope] = item[0]
+    return out
 
 
-def set_all_forms(form_key: str):
+def set_all_forms(form_key: str, guild_id=None):
     """
-    登録されている全ユーザーのフォームを一括変更。
-    新しいユーザーのデフォルトまでは変えない。
+    全ユーザー（guild_id を渡せばそのサーバーの全員）のフォームを一括変更。
+    レコードは書き換えず上書き設定を1件置くだけなので、まだ記録のない新しいユーザーにも効く。
     """
     if form_key not in VALID_FORM_KEYS:
         form_key = "cyrene"
-    data = load_forms()
-    for uid in list(data.keys()):
-        data[uid] = form_key
-    save_forms(data)
+    overrides.set_override("form", form_key, guild_id)
 
 
 def get_form_display_name(form_key: str) -> str:
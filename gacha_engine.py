@@ -0,0 +1,170 @@
+# gacha_engine.py
+import re
+import math
+import random
+from bisect import bisect_left
+from gacha_rates import (
+    calc_main_5star_rate, PAGE_DROP_RATE, FOUR_STAR_RATE, FOUR_STAR_PITY, PULL_COST,
+)
+
+# 「100連」「天井まで」用のまとめ引きエンジン。
+# logic.perform_gacha_pulls と同じ確率・天井・すり抜け確定・★4天井・ページ排出で、
+# 1連ずつ乱数を引く代わりに「次の★5まであと何連か」「次の★4まであと何連か」
+# 「次のページまであと何連か」を事前計算した累積分布から直接引く。
+# 計算量は連数ではなく★4/★5/ページの出た回数に比例する。
+
+BULK_MAX_PULLS = 1000
+
+# --- 事前計算テーブル ---
+def _build_five_star_cdf():
+    """_FIVE_CDF[p][k-1] = 天井カウント p から k 連以内に★5が出る確率"""
+    hard = next(p for p in range(1000) if calc_main_5star_rate(p) >= 1.0)
+    table = []
+    for start in range(hard + 1):
+        cdf, miss = [], 1.0
+        for p in range(start, hard + 1):
+            miss *= 1.0 - calc_main_5star_rate(p)
+            cdf.append(1.0 - miss)
+        cdf[-1] = 1.0
+        table.append(cdf)
+    return table
+
+
+def _build_four_star_cdf():
+    """_FOUR_CDF[q][j-1] = ★4カウント q から（★5以外の）j 連以内に★4が出る確率"""
+    table = []
+    for start in range(FOUR_STAR_PITY + 1):
+        cdf, miss = [], 1.0
+        for q in range(start, FOUR_STAR_PITY + 1):
+            miss *= 0.0 if q >= FOUR_STAR_PITY else 1.0 - FOUR_STAR_RATE
+            cdf.append(1.0 - miss)
+        table.append(cdf)
+    return table
+
+
+_FIVE_CDF = _build_five_star_cdf()
+_FOUR_CDF = _build_four_star_cdf()
+_LOG_NO_PAGE = math.log(1.0 - PAGE_DROP_RATE)
+
+
+def _pulls_until(cdf) -> int:
+    return bisect_left(cdf, random.random()) + 1
+
+
+def _pulls_until_five(pity_5: int) -> int:
+    return _pulls_until(_FIVE_CDF[min(pity_5, len(_FIVE_CDF) - 1)])
+
+
+def _count_four_stars(pity_4: int, pulls: int) -> tuple[int, int]:
+    """★5以外の pulls 連の★4数と、終了時の★4カウントを返す"""
+    fours = 0
+    while pulls > 0:
+        gap = _pulls_until(_FOUR_CDF[min(pity_4, FOUR_STAR_PITY)])
+        if gap > pulls:
+            return fours, pity_4 + pulls
+        fours, pulls, pity_4 = fours + 1, pulls - gap, 0
+    return fours, pity_4
+
+
+def _count_pages(pulls: int) -> int:
+    """各連独立に PAGE_DROP_RATE で出るページの数（幾何分布で次の当たりまで飛ばす）"""
+    hits, pos = 0, 0
+    while True:
+        pos += int(math.log(1.0 - random.random()) / _LOG_NO_PAGE) + 1
+        if pos > pulls:
+            return hits
+        hits += 1
+
+
+def simulate_pulls(state: dict, num_pulls: int, stop_on_cyrene: bool = False) -> dict:
+    """
+    state（ガチャ状態 dict）を num_pulls 連ぶん進め、集計を返す。
+    stop_on_cyrene=True なら、キュレネが出た10連の区切りで止める（天井まで引く用）。
+    石の消費はここでは行わない。
+    """
+    pity_5 = state.get("pity_5", 0)
+    pity_4 = state.get("pity_4", 0)
+    guaranteed = state.get("guaranteed_cyrene", False)
+    res = {"pulls": 0, "cyrene": 0, "offbanner": 0, "four": 0, "page": 0}
+
+    left = num_pulls
+    while left > 0:
+        gap = _pulls_until_five(pity_5)
+        if stop_on_cyrene and res["cyrene"]:
+            # キュレネが出た後は、その10連の残りだけ引く
+            left = min(left, (-res["pulls"]) % 10)
+            if left == 0: break
+        if gap > left:
+            fours, pity_4 = _count_four_stars(pity_4, left)
+            res["four"] += fours
+            pity_5 += left
+            res["pulls"] += left
+            break
+        fours, _ = _count_four_stars(pity_4, gap - 1)
+        res["four"] += fours
+        pity_5, pity_4 = 0, 0
+        if guaranteed or random.random() < 0.5:
+            res["cyrene"] += 1
+            guaranteed = False
+        else:
+            res["offbanner"] += 1
+            guaranteed = True
+        res["pulls"] += gap
+        left -= gap
+
+    res["page"] = _count_pages(res["pulls"])
+    state["pity_5"], state["pity_4"], state["guaranteed_cyrene"] = pity_5, pity_4, guaranteed
+    state["cyrene_copies"] = state.get("cyrene_copies", 0) + res["cyrene"]
+    state["offbanner_tickets"] = state.get("offbanner_tickets", 0) + res["offbanner"]
+    state["page1_count"] = state.get("page1_count", 0) + res["page"]
+    return res
+
+
+# --- コマンド ---
+_BULK_RE = re.compile(r"(\d+)\s*連")
+
+
+def parse_bulk_request(text: str):
+    """
+    「100連」→ 100、「天井まで」→ "ceiling"、それ以外（10連以下を含む）→ None
+    """
+    if "天井まで" in text:
+        return "ceiling"
+    m = _BULK_RE.search(text.translate(str.maketrans("０１２３４５６７８９", "0123456789")))
+    if m and int(m.group(1)) > 10:
+        return int(m.group(1))
+    return None
+
+
+def perform_bulk_pulls(ctx, request) -> tuple[bool, str]:
+    """まとめ引き。結果は1連ずつではなく集計だけ返す"""
+    state = ctx.gacha
+    stones = state.get("stones", 0)
+    if request == "ceiling":
+        budget = min(stones // (PULL_COST * 10) * 10, BULK_MAX_PULLS)
+        if budget <= 0: return False, f"石が足りないみたい（必要: {PULL_COST * 10}）"
+        res = simulate_pulls(state, budget, stop_on_cyrene=True)
+        label = "天井まで"
+    else:
+        if request > BULK_MAX_PULLS: return False, f"一度に引けるのは {BULK_MAX_PULLS} 連までよ。"
+        cost = PULL_COST * request
+        if stones < cost: return False, f"石が足りないみたい（必要: {cost}）"
+        res = simulate_pulls(state, request)
+        label = f"{request}連"
+
+    cost = PULL_COST * res["pulls"]
+    state["stones"] = stones - cost
+    ctx.mark("gacha")
+
+    summary = [f"★5キュレネ: {res['cyrene']}", f"★5すり抜け: {res['offbanner']}", f"★4: {res['four']}"]
+    if res["page"]: summary.append(f"★5ページ: {res['page']}")
+    next_up = "キュレネ確定" if state["guaranteed_cyrene"] else "50%でキュレネ"
+    tail = ""
+    if request == "ceiling" and not res["cyrene"]:
+        tail = "\n…石が尽きちゃった。キュレネはまた今度ね。"
+    return True, (
+        f"【{label}】{res['pulls']}連（石 {cost} 個消費）\n"
+        f"{' / '.join(summary)}\n"
+        f"天井カウント: {state['pity_5']} 連 (次の★5は {next_up})\n"
+        f"現在の石: {state['stones']} / チケット: {state['offbanner_tickets']}{tail}"
+    )
@@ -0,0 +1,105 @@
+# gacha_odds.py
+from functools import lru_cache
+from itertools import zip_longest
+from gacha_rates import calc_main_5star_rate
+
+# ガチャの確率計算（モンテカルロではなく厳密な分布）。
+# 状態は (天井カウント pity_5, キュレネ確定 guaranteed) だけで決まるので、
+# - 「次の★5まで k 連」の分布を天井カウントごとに事前計算し
+# - そこから「次のキュレネまで k 連」の分布（すり抜け50%→次は確定）を組み立て
+# - キュレネ2枚目以降は (0, False) からの同じ分布の畳み込みで数える
+# テーブルは import 時（起動時、イベントループが回り始める前）に全部作っておくので、問い合わせは表を引くだけ。
+
+MAX_COPIES = 7     # 好感度倍率（x2.4）が頭打ちになる枚数
+MAX_PULLS = 1000   # これより多い連数は 1000 連として扱う
+
+
+def _build_five_star_pmf():
+    """_FIVE_PMF[p][k] = 天井カウント p からちょうど k 連目に★5が出る確率（k=0 は 0）"""
+    hard = next(p for p in range(1000) if calc_main_5star_rate(p) >= 1.0)
+    table = []
+    for start in range(hard + 1):
+        pmf, alive = [0.0], 1.0
+        for p in range(start, hard + 1):
+            rate = calc_main_5star_rate(p)
+            pmf.append(alive * rate)
+            alive *= 1.0 - rate
+        table.append(pmf)
+    return table
+
+
+_FIVE_PMF = _build_five_star_pmf()
+_FIVE_MEAN = [sum(k * q for k, q in enumerate(pmf)) for pmf in _FIVE_PMF]
+
+
+def _clamp_pity(pity_5: int) -> int:
+    return max(0, min(int(pity_5), len(_FIVE_PMF) - 1))
+
+
+def _convolve(a, b, limit: int) -> list:
+    out = [0.0] * min(len(a) + len(b) - 1, limit + 1)
+    for i, x in enumerate(a):
+        if x == 0.0: continue
+        for j, y in enumerate(b[: len(out) - i]):
+            out[i + j] += x * y
+    return out
+
+
+def _cyrene_pmf(pity_5: int, guaranteed: bool) -> tuple:
+    """次のキュレネがちょうど k 連目に出る確率"""
+    first = _FIVE_PMF[pity_5]
+    if guaranteed:
+        return tuple(first)
+    # 50% でそのままキュレネ、50% ですり抜け → 天井0から確定の★5
+    again = _convolve(first, _FIVE_PMF[0], 10 ** 9)
+    return tuple(0.5 * x + 0.5 * y for x, y in zip_longest(first, again, fillvalue=0.0))
+
+
+def _cdf(pmf, length: int) -> tuple:
+    cdf, acc = [], 0.0
+    for k in range(length):
+        acc += pmf[k] if k < len(pmf) else 0.0
+        cdf.append(min(acc, 1.0))
+    return tuple(cdf)
+
+
+def _repeat_cdf(copies: int) -> tuple:
+    """(0, False) から copies 枚引き切るまでの連数が k 以下である確率（k=0..MAX_PULLS）"""
+    pmf = [1.0]
+    for _ in range(copies):
+        pmf = _convolve(pmf, _CYRENE_PMF[(0, False)], MAX_PULLS)
+    return _cdf(pmf, MAX_PULLS + 1)
+
+
+# (天井カウント, 確定) ごとの分布と、2枚目以降の分布
+_CYRENE_PMF = {(p, g): _cyrene_pmf(p, g) for p in range(len(_FIVE_PMF)) for g in (False, True)}
+_CYRENE_CDF = {key: _cdf(pmf, len(pmf)) for key, pmf in _CYRENE_PMF.items()}
+_REPEAT_CDF = [None] + [_repeat_cdf(c) for c in range(1, MAX_COPIES)]
+
+
+# --- 問い合わせ ---
+def expected_pulls_to_cyrene(pity_5: int, guaranteed: bool) -> float:
+    """今の状態から次のキュレネまでの期待連数"""
+    p = _clamp_pity(pity_5)
+    if guaranteed:
+        return _FIVE_MEAN[p]
+    return _FIVE_MEAN[p] + 0.5 * _FIVE_MEAN[0]
+
+
+def prob_cyrene_within(pity_5: int, guaranteed: bool, pulls: int) -> float:
+    """pulls 連以内に次のキュレネが出る確率"""
+    if pulls <= 0: return 0.0
+    cdf = _CYRENE_CDF[(_clamp_pity(pity_5), bool(guaranteed))]
+    return cdf[min(pulls, len(cdf) - 1)]
+
+
+@lru_cache(maxsize=4096)
+def prob_copies_within(pity_5: int, guaranteed: bool, copies: int, pulls: int) -> float:
+    """pulls 連以内にキュレネを copies 枚以上引ける確率（copies は MAX_COPIES まで）"""
+    if copies <= 0: return 1.0
+    if pulls <= 0: return 0.0
+    if copies == 1: return prob_cyrene_within(pity_5, guaranteed, pulls)
+    pulls = min(pulls, MAX_PULLS)
+    first = _CYRENE_PMF[(_clamp_pity(pity_5), bool(guaranteed))]
+    rest = _REPEAT_CDF[min(copies, MAX_COPIES) - 1]
+    return min(1.0, sum(first[j] * rest[pulls - j] for j in range(1, min(len(first) - 1, pulls) + 1)))
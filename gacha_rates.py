@@ -0,0 +1,16 @@
+# gacha_rates.py
+
+# ガチャの排出率と天井の定義。
+# logic（1連ずつ引く処理）・gacha_engine（まとめ引き）・gacha_odds（確率計算）が共通で使う。
+
+PAGE_DROP_RATE = 0.0006   # ★5【??? その1】（天井とは独立）
+FOUR_STAR_RATE = 0.24
+FOUR_STAR_PITY = 9        # ★4 天井（pity_4 がこの値以上なら次は★4確定）
+PULL_COST = 160
+
+def calc_main_5star_rate(pity_5: int) -> float:
+    base = 0.0006
+    if pity_5 <= 73: return base
+    if pity_5 < 89:
+        return min(1.0, base + (1.0 - base) * ((pity_5 - 73) / 15))
+    return 1.0
@@ -0,0 +1,139 @@
+# leaderboard.py
+from bisect import bisect_left, insort
+
+# 好感度XPのランキング用の索引。
+# - 中身は「(−XP, user_id) を昇順に並べた短いリスト」の列（チャンク分割したソート済みリスト）
+# - XP が変わったユーザーだけ抜いて差し直すので、全員分を並べ直すことはない
+# - 何位か・k ページ目かは、チャンクごとの件数を持つ Fenwick 木で O(log n) で求める
+# - 最初の参照時に loader() が返す {user_id: XP} から組み立てる（それまでの update は読み飛ばす）
+
+_CHUNK = 256
+
+
+class XpLeaderboard:
+    def __init__(self, loader):
+        self._loader = loader
+        self._xp = None       # user_id -> XP（None なら未構築）
+        self._chunks = []     # ソート済みのキー (−XP, user_id) のリスト
+        self._maxes = []      # 各チャンクの最後のキー
+        self._tree = []       # チャンクの件数の Fenwick 木（1始まり）
+
+    # --- 構築 ---
+    def _ensure_built(self) -> None:
+        if self._xp is not None: return
+        xp = {int(uid): max(0, int(v)) for uid, v in self._loader().items()}
+        keys = sorted((-v, uid) for uid, v in xp.items())
+        self._xp = xp
+        self._chunks = [keys[i:i + _CHUNK] for i in range(0, len(keys), _CHUNK)]
+        self._reindex()
+
+    def _reindex(self) -> None:
+        self._maxes = [c[-1] for c in self._chunks]
+        n = len(self._chunks)
+        tree = [0] * (n + 1)
+        for i, c in enumerate(self._chunks, 1):
+            tree[i] += len(c)
+            j = i + (i & -i)
+            if j <= n: tree[j] += tree[i]
+        self._tree = tree
+
+    def invalidate(self) -> None:
+        """保存データを丸ごと差し替えたときなど。次の参照時に作り直す"""
+        self._xp = None
+
+    # --- Fenwick 木 ---
+    def _tree_add(self, i: int, delta: int) -> None:
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _tree_prefix(self, i: int) -> int:
+        """先頭から i 個のチャンクの件数の合計"""
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, pos: int):
+        """全体で pos 番目（0始まり）が入っているチャンク番号と、その中の位置"""
+        idx, step = 0, 1 << (len(self._tree).bit_length())
+        while step:
+            nxt = idx + step
+            if nxt < len(self._tree) and self._tree[nxt] <= pos:
+                idx = nxt
+                pos -= self._tree[nxt]
+            step >>= 1
+        return idx, pos
+
+    # --- 更新 ---
+    def _insert(self, key) -> None:
+        if not self._chunks:
+            self._chunks.append([key])
+            self._reindex()
+            return
+        ci = min(bisect_left(self._maxes, key), len(self._chunks) - 1)
+        chunk = self._chunks[ci]
+        insort(chunk, key)
+        self._maxes[ci] = chunk[-1]
+        if len(chunk) > 2 * _CHUNK:
+            self._chunks[ci:ci + 1] = [chunk[:_CHUNK], chunk[_CHUNK:]]
+            self._reindex()
+        else:
+            self._tree_add(ci, 1)
+
+    def _remove(self, key) -> None:
+        ci = bisect_left(self._maxes, key)
+        chunk = self._chunks[ci]
+        del chunk[bisect_left(chunk, key)]
+        if chunk:
+            self._maxes[ci] = chunk[-1]
+            self._tree_add(ci, -1)
+        else:
+            del self._chunks[ci]
+            self._reindex()
+
+    def update(self, user_id: int, xp: int) -> None:
+        """user_id の XP が xp になった（未構築なら何もしない）"""
+        if self._xp is None: return
+        user_id, xp = int(user_id), max(0, int(xp))
+        old = self._xp.get(user_id)
+        if old == xp: return
+        if old is not None:
+            self._remove((-old, user_id))
+        self._xp[user_id] = xp
+        self._insert((-xp, user_id))
+
+    # --- 参照 ---
+    def __len__(self) -> int:
+        self._ensure_built()
+        return len(self._xp)
+
+    def rank(self, user_id: int):
+        """1始まりの順位（載っていなければ None）"""
+        self._ensure_built()
+        xp = self._xp.get(int(user_id))
+        if xp is None: return None
+        key = (-xp, int(user_id))
+        ci = bisect_left(self._maxes, key)
+        return self._tree_prefix(ci) + bisect_left(self._chunks[ci], key) + 1
+
+    def slice(self, start: int, count: int) -> list:
+        """start 番目（0始まり）から count 件の [(user_id, XP)]"""
+        self._ensure_built()
+        out = []
+        if start < 0 or start >= len(self._xp): return out
+        ci, i = self._locate(start)
+        while ci < len(self._chunks) and len(out) < count:
+            chunk = self._chunks[ci]
+            out.extend((uid, -neg) for neg, uid in chunk[i:i + count - len(out)])
+            ci, i = ci + 1, 0
+        return out
+
+    def top(self, n: int) -> list:
+        return self.slice(0, n)
+
+    def page(self, k: int, size: int) -> list:
+        """k ページ目（1始まり）"""
+        return self.slice((k - 1) * size, size)
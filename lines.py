@@ -1,4 +1,5 @@
 import random
+import triggers
 
 CYRENE_LINES = {
     "greeting": [
@@ -202,8 +203,16 @@ def _maybe_high_affection_override(base_line: str, affection_level: int) -> str:
     return base_line
 
 
+_GREETING_TRIGGERS = triggers.register("hello♪", "hi♪", "hey♪", "こんにちは♪", "こんばんは♪", "おはよう♪", "ハーイ♪")
+triggers.register(
+    "甘えていいんだよ", "みんなについて教えて", "戦闘中のやつやってよ", "ec", "長夜月", "楽しいね",
+    "自己紹介して", "穹くんやって", "記憶は流れ星を待ってる", "記憶は流れ星を待っている",
+)
+
+
 def get_cyrene_reply(message: str, affection_level: int = 1) -> str:
     msg = message.lower().strip()
+    hits = triggers.scan(msg)
 
     # ① @のみ（内容が空）のとき → 好感度ボイス適用
     if msg == "":
@@ -211,27 +220,27 @@ def get_cyrene_reply(message: str, affection_level: int = 1) -> str:
         return _maybe_high_affection_override(base, affection_level)
 
     # ② 挨拶 → 好感度ボイス適用
-    if any(w in msg for w in ["hello♪", "hi♪", "hey♪", "こんにちは♪", "こんばんは♪", "おはよう♪", "ハーイ♪"]):
+    if hits & _GREETING_TRIGGERS:
         base = random.choice(CYRENE_LINES["greeting"])
         return _maybe_high_affection_override(base, affection_level)
 
     # ③ 甘える → 好感度ボイス適用
-    if "甘えていいんだよ" in msg:
+    if "甘えていいんだよ" in hits:
         base = random.choice(CYRENE_LINES["amaeru"])
         return _maybe_high_affection_override(base, affection_level)
 
     # ──────── ここから下は好感度ボイス【なし】 ────────
 
     # ④ みんなについて → そのまま返す
-    if "みんなについて教えて" in msg:
+    if "みんなについて教えて" in hits:
         return random.choice(CYRENE_LINES["askaboutothers"])
 
     # ⑤ 戦闘ボイス → そのまま返す
-    if "戦闘中のやつやってよ" in msg:
+    if "戦闘中のやつやってよ" in hits:
         return random.choice(CYRENE_LINES["battlevoices"])
 
     # ⑥ EC：長夜月 → そのまま返す
-    if "ec" in msg and "長夜月" in msg:
+    if "ec" in hits and "長夜月" in hits:
         return (
             random.choice(CYRENE_LINES["nagayozuki1"])
             + "\n"
@@ -239,13 +248,13 @@ def get_cyrene_reply(message: str, affection_level: int = 1) -> str:
         )
 
     # ⑦ 楽しいね → そのまま返す（ただしセリフは固定）
-    if "楽しいね" in msg:
+    if "楽しいね" in hits:
         return (
             "あなたと2人きりでいると時間があっという間にすぎてしまうわ♪"
             "あなたの時間がまだあるならもう少しお話ししないかしら♪"
         )
 
-    if "自己紹介して" in msg:
+    if "自己紹介して" in hits:
         return (
             "こんにちは、あたしはキュレネよ♪\n"
             "みんなについて教えてと言ってくれればあたしなりの意見を言うわ♪\n"
@@ -255,10 +264,10 @@ def get_cyrene_reply(message: str, affection_level: int = 1) -> str:
             "みんな、あたしともっと仲良くしてね♪"
         )
 
-    if "穹くんやって" in msg:
+    if "穹くんやって" in hits:
         return "(低い声で)やあ♪"
 
-    if "記憶は流れ星を待ってる" in msg or "記憶は流れ星を待っている" in msg:
+    if "記憶は流れ星を待ってる" in hits or "記憶は流れ星を待っている" in hits:
         return "愛であたしを心に刻んで。あの美しい明日が訪れた瞬間に♪"
 
     # ⑧ 既定（知らないセリフ）→ そのまま返す
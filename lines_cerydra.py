@@ -1,4 +1,6 @@
 import random
+import triggers
+from templates import render
 
 CHAR_NAME = "ケリュドラ"
 
@@ -66,7 +68,9 @@ def _pick_high_affection_line(affection_level: int) -> str | None:
     selected_tier = random.choices(valid_tiers, weights=weights, k=1)[0]
     return random.choice(LINES[f"high_l{selected_tier}"])
 
-# 修正: user_name 引数を追加し、replace で名前を埋め込み
+_AFFECTION_TRIGGERS = triggers.register("こんにちは", "おはよう", "甘えて")
+
+# 修正: user_name 引数を追加し、セリフに名前を埋め込み
 def get_reply(message: str, affection_level: int, user_name: str) -> str:
     # 抽選ロジック: Lv1~2:10%, Lv3:60%, Lv4~:70% で好感度ボイス
     high_prob = 0.1
@@ -74,7 +78,7 @@ def get_reply(message: str, affection_level: int, user_name: str) -> str:
     elif affection_level >= 4: high_prob = 0.7
 
     # メッセージが空（メンションのみ）、挨拶、甘える等の場合に判定
-    msg_check = message.strip() == "" or any(x in message for x in ["こんにちは", "おはよう", "甘えて"])
+    msg_check = message.strip() == "" or bool(triggers.scan(message) & _AFFECTION_TRIGGERS)
     
     line = None
     if msg_check and random.random() < high_prob:
@@ -84,16 +88,16 @@ def get_reply(message: str, affection_level: int, user_name: str) -> str:
         line = random.choice(LINES["normal"])
 
     # ここで {name} を置き換えます
-    return line.replace("{name}", user_name)
+    return render(line, user_name)
 
 # 修正: user_name 引数を追加
 def get_nickname_line(action: str, user_name: str) -> str:
     key = "nickname_ask" if action == "ask" else "nickname_confirm"
     line = random.choice(LINES.get(key, ["..."]))
-    return line.replace("{name}", user_name)
+    return render(line, user_name)
 
 # 修正: user_name 引数を追加
 def get_rps_flavor(result: str, user_name: str) -> str:
     key = f"rps_{result}"
     line = random.choice(LINES.get(key, ["..."]))
-    return line.replace("{name}", user_name)
\ No newline at end of file
+    return render(line, user_name)
\ No newline at end of file
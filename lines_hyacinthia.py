@@ -1,4 +1,6 @@
 import random
+import triggers
+from templates import render
 
 CHAR_NAME = "ヒアシンシア"
 
@@ -66,13 +68,15 @@ def _pick_high_affection_line(affection_level: int) -> str | None:
     selected_tier = random.choices(valid_tiers, weights=weights, k=1)[0]
     return random.choice(LINES[f"high_l{selected_tier}"])
 
-# 修正: user_name 引数を追加し、戻り値で replace を実行
+_AFFECTION_TRIGGERS = triggers.register("こんにちは", "おはよう", "甘えて")
+
+# 修正: user_name 引数を追加し、戻り値に名前を埋め込み
 def get_reply(message: str, affection_level: int, user_name: str) -> str:
     high_prob = 0.1
     if affection_level == 3: high_prob = 0.6
     elif affection_level >= 4: high_prob = 0.7
 
-    msg_check = message.strip() == "" or any(x in message for x in ["こんにちは", "おはよう", "甘えて"])
+    msg_check = message.strip() == "" or bool(triggers.scan(message) & _AFFECTION_TRIGGERS)
     
     line = None
     if msg_check and random.random() < high_prob:
@@ -82,16 +86,16 @@ def get_reply(message: str, affection_level: int, user_name: str) -> str:
         line = random.choice(LINES["normal"])
     
     # ここで {name} を置き換えます
-    return line.replace("{name}", user_name)
+    return render(line, user_name)
 
 # 修正: user_name 引数を追加
 def get_nickname_line(action: str, user_name: str) -> str:
     key = "nickname_ask" if action == "ask" else "nickname_confirm"
     line = random.choice(LINES.get(key, ["..."]))
-    return line.replace("{name}", user_name)
+    return render(line, user_name)
 
 # 修正: user_name 引数を追加
 def get_rps_flavor(result: str, user_name: str) -> str:
     key = f"rps_{result}"
     line = random.choice(LINES.get(key, ["..."]))
-    return line.replace("{name}", user_name)
\ No newline at end of file
+    return render(line, user_name)
\ No newline at end of file
@@ -0,0 +1,58 @@
+# locks.py
+import time
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+
+# ユーザーごとの排他。1ユーザーのメッセージ処理（状態を読む → 書き換える → 書き戻す）を1つずつ順番に通す。
+# - ロックは初めて使うときに作り、だれも持っていない・待っていないものは WeakValueDictionary から自然に消える
+# - 別のユーザーどうしは互いに待たない
+# - 待たされた回数・時間を stats() で見られる
+
+
+class UserLockManager:
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()  # user_id -> asyncio.Lock
+        # 統計
+        self.acquired = 0
+        self.contended = 0     # すでにだれかが持っていて待たされた回数
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def __len__(self) -> int:
+        """いま生きているロックの数"""
+        return len(self._locks)
+
+    def _lock_for(self, user_id: int) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user_id] = lock
+        return lock
+
+    @asynccontextmanager
+    async def hold(self, user_id: int):
+        lock = self._lock_for(user_id)  # 待っているあいだもこの参照でロックが生き残る
+        self.acquired += 1
+        if lock.locked():
+            self.contended += 1
+            start = time.monotonic()
+            await lock.acquire()
+            waited = time.monotonic() - start
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        else:
+            await lock.acquire()
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def stats(self) -> dict:
+        return {
+            "live": len(self._locks), "acquired": self.acquired, "contended": self.contended,
+            "wait_avg": self.wait_total / max(1, self.contended), "wait_max": self.wait_max,
+        }
+
+
+USER_LOCKS = UserLockManager()
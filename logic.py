@@ -1,108 +1,175 @@
 # logic.py
 import random
 import re
-from config import today_str
+import time
+from config import today_str, XP_FLUSH_INTERVAL, XP_FLUSH_EVENTS
 import database as db
+from leaderboard import XpLeaderboard
+from members import MEMBER_NAMES
+from outbox import OUTBOX
+from gacha_rates import calc_main_5star_rate, PAGE_DROP_RATE, FOUR_STAR_RATE, FOUR_STAR_PITY, PULL_COST
+import gacha_odds
 
 # --- 好感度ロジック ---
-def get_level_from_xp(xp: int, cfg: dict) -> int:
-    thresholds = cfg.get("level_thresholds", [0])
-    if len(thresholds) <= 1: return 1
-    level = 1
-    for lv in range(1, len(thresholds)):
-        if xp >= thresholds[lv]: level = lv
-        else: break
-    return max(1, level)
+def get_level_from_xp(xp: int, cfg) -> int:
+    """cfg は settings.AffectionConfig（必要XPの表を二分探索）"""
+    return cfg.level_for(xp)
+
+# --- 好感度XPのまとめ書き ---
+class XpAccumulator:
+    """
+    ユーザーごとの XP 加算をメモリに溜めておき、
+    一定時間（flush_interval 秒）か一定件数（flush_events 回）ごとにまとめて保存する。
+    倍率は add_affection_xp 側で適用済みの値を受け取る。
+    """
+
+    def __init__(self, flush_interval: float, flush_events: int):
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self._pending = {}
+        self._events = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, user_id: int, delta: int) -> None:
+        if delta == 0: return
+        self._pending[user_id] = self._pending.get(user_id, 0) + delta
+        self._events += 1
+        AFFECTION_RANKING.update(user_id, get_user_xp(user_id))
+        if self._events >= self.flush_events:
+            self.flush()
+
+    def pending(self, user_id: int) -> int:
+        return self._pending.get(user_id, 0)
+
+    def pending_all(self) -> dict:
+        return self._pending
+
+    def maybe_flush(self) -> int:
+        if time.monotonic() - self._last_flush < self.flush_interval:
+            return 0
+        return self.flush()
+
+    def flush(self) -> int:
+        """溜まっている差分をユーザーごとに1回ずつ書き込み、件数を返す"""
+        pending, self._pending = self._pending, {}
+        self._events = 0
+        self._last_flush = time.monotonic()
+        for user_id, delta in pending.items():
+            if delta: db.increment_affection_xp(user_id, delta)
+        return len(pending)
+
+XP_ACCUMULATOR = XpAccumulator(XP_FLUSH_INTERVAL, XP_FLUSH_EVENTS)
+
+def get_user_xp(user_id: int) -> int:
+    """保存済みの XP に、まだ書き込んでいない加算分を足した値"""
+    return max(0, db.get_affection_xp(user_id) + XP_ACCUMULATOR.pending(user_id))
 
 def get_user_affection(user_id: int):
     cfg = db.load_affection_config()
-    data = db.load_affection_data()
-    info = data.get(str(user_id), {})
-    xp = int(info.get("xp", 0))
+    xp = get_user_xp(user_id)
     return xp, get_level_from_xp(xp, cfg)
 
-def get_cyrene_affection_multiplier(user_id: int) -> float:
+def get_cyrene_affection_multiplier(ctx) -> float:
     try:
-        state = db.get_gacha_state(user_id)
+        state = ctx.gacha
         copies = int(state.get("cyrene_copies", 0))
         mult = 1.0 + 0.2 * copies
         return min(2.4, mult)
     except: return 1.0
 
-def add_affection_xp(user_id: int, delta: int, reason: str = ""):
-    if delta == 0: return
+def add_affection_xp(ctx, delta: int, reason: str = ""):
+    if delta == 0 or ctx.degraded: return
     if delta > 0:
-        mult = get_cyrene_affection_multiplier(user_id)
+        mult = get_cyrene_affection_multiplier(ctx)
         if mult != 1.0:
             delta = int(delta * mult)
             if delta < 1: delta = 1
-    data = db.load_affection_data()
-    info = data.get(str(user_id), {})
-    xp = max(0, int(info.get("xp", 0)) + delta)
-    info["xp"] = xp
-    data[str(user_id)] = info
-    db.save_affection_data(data)
-
-# ★管理者用：全員のリスト
-def format_all_affection_status(guild) -> str:
-    data = db.load_affection_data()
-    if not data:
+    ctx.add_xp(delta)
+
+# --- 好感度ランキング ---
+def _load_ranking_xp() -> dict:
+    xp = {uid: int(info.get("xp", 0)) for uid, info in db.load_affection_data().items() if isinstance(info, dict)}
+    for uid, d in XP_ACCUMULATOR.pending_all().items():
+        xp[str(uid)] = xp.get(str(uid), 0) + d
+    return {uid: v for uid, v in xp.items() if str(uid).isdigit()}
+
+# XP_ACCUMULATOR.add のたびに該当ユーザーだけ差し直す
+AFFECTION_RANKING = XpLeaderboard(_load_ranking_xp)
+
+def _on_affection_written(user_id=None) -> None:
+    # 保存データを直接書き換えた分（一括の差し替えは作り直し）
+    if user_id is None: AFFECTION_RANKING.invalidate()
+    else: AFFECTION_RANKING.update(user_id, get_user_xp(user_id))
+
+db.watch_affection(_on_affection_written)
+AFFECTION_PAGE_SIZE = 20
+
+# ★管理者用：全員のリスト（ページ単位）
+async def format_all_affection_status(guild, page: int = 1) -> str:
+    total = len(AFFECTION_RANKING)
+    if not total:
         return "まだ好感度データは誰も登録されていないみたい。"
-    
+
     cfg = db.load_affection_config()
-    
-    user_list = []
-    for uid_str, info in data.items():
-        xp = int(info.get("xp", 0))
-        level = get_level_from_xp(xp, cfg)
-        user_list.append((uid_str, xp, level))
-    
-    user_list.sort(key=lambda x: x[1], reverse=True)
-    
-    lines = ["【みんなの好感度・経験値一覧】"]
-    for uid_str, xp, level in user_list:
-        name = f"ID: {uid_str}"
-        if guild:
-            try:
-                member = guild.get_member(int(uid_str))
-                if member: name = member.display_name
-            except: pass
-        lines.append(f"- **{name}**: Lv.{level} ({xp} XP)")
-        
+    pages = (total + AFFECTION_PAGE_SIZE - 1) // AFFECTION_PAGE_SIZE
+    page = min(max(1, page), pages)
+    start = (page - 1) * AFFECTION_PAGE_SIZE
+
+    rows = AFFECTION_RANKING.slice(start, AFFECTION_PAGE_SIZE)
+    names = await MEMBER_NAMES.resolve(guild, [uid for uid, _ in rows])
+
+    lines = [f"【みんなの好感度・経験値一覧】({page}/{pages}ページ・{total}人)"]
+    for i, (uid, xp) in enumerate(rows, start + 1):
+        name = names.get(uid, f"ID: {uid}")
+        lines.append(f"{i}. **{name}**: Lv.{get_level_from_xp(xp, cfg)} ({xp} XP)")
+    if page < pages:
+        lines.append(f"\n続きは `好感度一覧 {page + 1}` で見られるわ。")
     return "\n".join(lines)
 
 # ★一般ユーザー用好感度メッセージ
-def get_affection_status_message(user_id: int) -> str:
-    xp, level = get_user_affection(user_id)
-    cfg = db.load_affection_config()
-    thresholds = cfg.get("level_thresholds", [0])
+def get_affection_status_message(ctx) -> str:
+    xp, level = ctx.xp, ctx.level
+    thresholds = ctx.affection_config.level_thresholds
     
+    rank = AFFECTION_RANKING.rank(ctx.user_id)
+    rank_text = f"（{rank}位 / {len(AFFECTION_RANKING)}人中）" if rank else ""
+
     if level + 1 < len(thresholds):
         next_xp_req = thresholds[level + 1]
         needed = max(0, next_xp_req - xp)
-        return (f"あなたの好感度は **Lv.{level}** (累計 {xp} XP) よ♪\n"
+        return (f"あなたの好感度は **Lv.{level}** (累計 {xp} XP) よ♪{rank_text}\n"
                 f"次の Lv.{level + 1} までは、あと **{needed} XP** 必要ね。")
     else:
-        return (f"あなたの好感度は **Lv.{level}** (累計 {xp} XP) よ♪\n"
+        return (f"あなたの好感度は **Lv.{level}** (累計 {xp} XP) よ♪{rank_text}\n"
                 "もう十分すぎるくらい仲良しね！これ以上は数え切れないわ♪")
 
 # --- ミュリオンロジック ---
 MYURION_SYLLABLES = ["ミュ", "ミュウ", "ミュミュ", "ミュイー"]
+MYURION_KEEP_CHARS = "\r\n。、！？…,.!?「」『』()（）[]【】:：;；/｜|\\-—ー♪☆★"
+
+# 変換は「残す文字・空白以外」の1文字ごとに分割し、
+# 分割した数だけまとめて引いた音節を差し込む（1文字ずつ random.choice しない）
+# 分類は起動時に作る文字クラス1つで行う（見かけた文字を覚えていかない）
+_MYURION_CONVERT_RE = re.compile("[^\\s" + re.escape(MYURION_KEEP_CHARS) + "]")
+_MYURION_SYLLABLE_BY_BYTE = [MYURION_SYLLABLES[b & 3] for b in range(256)]
 
 def to_myurion_text(body: str) -> str:
-    result = []
-    for ch in body:
-        if ch in "\r\n" or ch.isspace() or ch in "。、！？…,.!?「」『』()（）[]【】:：;；/｜|\\-—ー♪☆★":
-            result.append(ch)
-        else:
-            result.append(random.choice(MYURION_SYLLABLES))
-    return "".join(result)
+    pieces = _MYURION_CONVERT_RE.split(body)
+    count = len(pieces) - 1
+    if count == 0:
+        return body
+    rnd = random.getrandbits(8 * count).to_bytes(count, "little")
+    out = [None] * (2 * count + 1)
+    out[0::2] = pieces
+    out[1::2] = map(_MYURION_SYLLABLE_BY_BYTE.__getitem__, rnd)
+    return "".join(out)
+
+_MENTION_PREFIX_RE = re.compile(r"^(<@!?\d+>)(.*)$", flags=re.DOTALL)
 
-def apply_myurion_filter(user_id: int, text: str) -> str:
-    st = db.get_myurion_state(user_id)
-    if not st.get("enabled", False):
+def apply_myurion_filter(ctx, text: str) -> str:
+    if ctx.degraded or not ctx.myurion_enabled:
         return text
-    m = re.match(r"^(<@!?\d+>)(.*)$", text, flags=re.DOTALL)
+    m = _MENTION_PREFIX_RE.match(text)
     if not m: return to_myurion_text(text)
     return m.group(1) + to_myurion_text(m.group(2))
 
@@ -122,7 +189,8 @@ MYURION_QUESTIONS = [
     {"q": "ミュミュミュミュウミュウミュウミュウミュウミュウミュウミュウ？", "choices": ["ミュウ!", "ミュウ?", "ミュウ。", "ミュウ♪"], "answer_index": 0},
 ]
 
-async def send_myurion_question(message, user_id, correct_count, state_dict):
+async def send_myurion_question(message, ctx) -> dict:
+    """クイズを1問出して、回答待ちセッションに持たせる情報を返す"""
     q = random.choice(MYURION_QUESTIONS)
     indexed = list(enumerate(q["choices"]))
     random.shuffle(indexed)
@@ -132,28 +200,22 @@ async def send_myurion_question(message, user_id, correct_count, state_dict):
             correct_index = new_idx
             break
     options_text = "\n".join([f"{i+1}. {c}" for i, (_, c) in enumerate(indexed)])
+    correct_count = ctx.myurion.get("quiz_correct", 0)
     body = (f"ミュミュミュ…（現在 {correct_count}/3 問正解ミュ）\n{q['q']}\n"
             f"ミュミュ…好きな番号を選んでミュ（1〜4）\n\n{options_text}")
-    state_dict[user_id] = {"question": q, "options": [c for _, c in indexed], "correct_index": correct_index}
-    await message.channel.send(apply_myurion_filter(user_id, f"{message.author.mention} {body}"))
+    OUTBOX.post(message.channel, apply_myurion_filter(ctx, f"{message.author.mention} {body}"))
+    return {"correct_index": correct_index}
 
 # --- ガチャロジック ---
-def calc_main_5star_rate(pity_5: int) -> float:
-    base = 0.0006
-    if pity_5 <= 73: return base
-    if pity_5 < 89:
-        return min(1.0, base + (1.0 - base) * ((pity_5 - 73) / 15))
-    return 1.0
-
-def perform_gacha_pulls(user_id: int, num_pulls: int, use_ticket: bool = False) -> tuple[bool, str]:
-    state = db.get_gacha_state(user_id)
+def perform_gacha_pulls(ctx, num_pulls: int, use_ticket: bool = False) -> tuple[bool, str]:
+    state = ctx.gacha
     if use_ticket:
         if num_pulls != 10: return False, "チケットは10連専用みたい。"
         if state.get("offbanner_tickets", 0) <= 0: return False, "チケットが足りないみたい。"
         state["offbanner_tickets"] -= 1
         cost_str = "（チケット1枚消費）"
     else:
-        cost = 160 * num_pulls if num_pulls == 1 else 1600
+        cost = PULL_COST * num_pulls if num_pulls == 1 else PULL_COST * 10
         if state.get("stones", 0) < cost: return False, f"石が足りないみたい（必要: {cost}）"
         state["stones"] -= cost
         cost_str = f"（石 {cost} 個消費）"
@@ -165,7 +227,7 @@ def perform_gacha_pulls(user_id: int, num_pulls: int, use_ticket: bool = False)
 
     for _ in range(num_pulls):
         page_got = False
-        if random.random() < 0.0006:
+        if random.random() < PAGE_DROP_RATE:
             state["page1_count"] = state.get("page1_count", 0) + 1
             page_hits += 1
             page_got = True
@@ -184,7 +246,7 @@ def perform_gacha_pulls(user_id: int, num_pulls: int, use_ticket: bool = False)
             if page_got: txt += " ＋ ★5【??? その1】"
         else:
             pity_5 += 1
-            if pity_4 >= 9 or random.random() < 0.24:
+            if pity_4 >= FOUR_STAR_PITY or random.random() < FOUR_STAR_RATE:
                 pity_4 = 0
                 txt = "★4"
             else:
@@ -194,7 +256,7 @@ def perform_gacha_pulls(user_id: int, num_pulls: int, use_ticket: bool = False)
         results.append(txt)
 
     state["pity_5"], state["pity_4"], state["guaranteed_cyrene"] = pity_5, pity_4, guaranteed
-    db.save_gacha_state(user_id, state)
+    ctx.mark("gacha")
 
     summary = []
     if cyrene_hit: summary.append(f"★5キュレネ: {cyrene_hit}")
@@ -205,33 +267,43 @@ def perform_gacha_pulls(user_id: int, num_pulls: int, use_ticket: bool = False)
     body = "\n".join([f"{i+1}: {r}" for i, r in enumerate(results)])
     return True, f"{cost_str}\n{body}\n\n{sum_text}\n現在の石: {state['stones']} / チケット: {state['offbanner_tickets']}"
 
-def grant_daily_stones(user_id: int) -> tuple[bool, int, str]:
-    state = db.get_gacha_state(user_id)
+def grant_daily_stones(ctx) -> tuple[bool, int, str]:
+    state = ctx.gacha
     if state.get("last_daily") == today_str():
         return False, state["stones"], "今日はもう受け取っているみたい。"
     state["stones"] = state.get("stones", 0) + 16000
     state["last_daily"] = today_str()
-    db.save_gacha_state(user_id, state)
+    ctx.mark("gacha")
     return True, state["stones"], "デイリー報酬 16000個 を付与したわ♪"
 
 # ★追加：ガチャステータス表示
-def format_gacha_status(user_id: int) -> str:
-    state = db.get_gacha_state(user_id)
+def format_gacha_status(ctx) -> str:
+    state = ctx.gacha
     stones = state.get("stones", 0)
     pity_5 = state.get("pity_5", 0)
     cyrene_copies = state.get("cyrene_copies", 0)
     tickets = state.get("offbanner_tickets", 0)
     guaranteed = state.get("guaranteed_cyrene", False)
-    mult = get_cyrene_affection_multiplier(user_id)
+    mult = get_cyrene_affection_multiplier(ctx)
     
     next_up = "キュレネ確定" if guaranteed else "50%でキュレネ"
-    
+
+    # 確率は gacha_odds の事前計算テーブルから引く
+    budget = stones // PULL_COST + tickets * 10
+    expected = gacha_odds.expected_pulls_to_cyrene(pity_5, guaranteed)
+    odds = f"・次のキュレネまで: 平均 {expected:.1f} 連\n"
+    if budget > 0:
+        p1 = gacha_odds.prob_copies_within(pity_5, guaranteed, 1, budget)
+        p2 = gacha_odds.prob_copies_within(pity_5, guaranteed, 2, budget)
+        odds += f"・手持ち（{budget}連分）でキュレネ: 1枚以上 {p1 * 100:.1f}% / 2枚以上 {p2 * 100:.1f}%\n"
+
     return (
         "【ガチャメニュー】\n"
         f"・所持石: {stones} 個\n"
         f"・キュレネ所持: {cyrene_copies} 枚 (好感度倍率 x{mult:.1f})\n"
         f"・すり抜けチケット: {tickets} 枚\n"
-        f"・天井カウント: {pity_5} 連 (次の★5は {next_up})\n\n"
+        f"・天井カウント: {pity_5} 連 (次の★5は {next_up})\n"
+        f"{odds}\n"
         "『単発ガチャ』『10連ガチャ』で引けるわよ♪"
     )
 
@@ -0,0 +1,66 @@
+# members.py
+import time
+from config import MEMBER_NAME_TTL
+
+# 一覧表示（好感度一覧・あだ名一覧・変身状況など）で使う「user_id → 表示名」の解決。
+# - まずこのモジュールのキャッシュ、次に discord.py のメンバーキャッシュ（guild.get_member）を見る
+# - どちらにもいない分だけ、guild.query_members でまとめて問い合わせる（1回あたり最大100人）
+# - 引けた名前も、サーバーにいなかったという結果も MEMBER_NAME_TTL 秒だけ覚えておく
+
+QUERY_CHUNK = 100
+PRUNE_SIZE = 10000  # キャッシュがこれを超えたら期限切れを掃除する
+
+
+class MemberNameResolver:
+    def __init__(self, ttl: float = MEMBER_NAME_TTL):
+        self.ttl = ttl
+        self._cache = {}  # (guild_id, user_id) -> (表示名 or None, 期限)
+
+    def _cached(self, guild_id: int, user_id: int, now: float):
+        entry = self._cache.get((guild_id, user_id))
+        if entry is None or entry[1] <= now: return False, None
+        return True, entry[0]
+
+    def _store(self, guild_id: int, user_id: int, name, now: float) -> None:
+        self._cache[(guild_id, user_id)] = (name, now + self.ttl)
+
+    def prune(self) -> int:
+        """期限切れのエントリを消して、消した数を返す"""
+        now = time.time()
+        expired = [k for k, (_, exp) in self._cache.items() if exp <= now]
+        for k in expired: del self._cache[k]
+        return len(expired)
+
+    async def resolve(self, guild, user_ids) -> dict:
+        """{user_id: 表示名}。引けなかった ID は含めない"""
+        if guild is None: return {}
+        if len(self._cache) > PRUNE_SIZE: self.prune()
+        now = time.time()
+        names, missing = {}, []
+        for uid in dict.fromkeys(int(u) for u in user_ids):
+            hit, name = self._cached(guild.id, uid, now)
+            if not hit:
+                member = guild.get_member(uid)
+                if member is None:
+                    missing.append(uid)
+                    continue
+                name = member.display_name
+                self._store(guild.id, uid, name, now)
+            if name is not None: names[uid] = name
+
+        for i in range(0, len(missing), QUERY_CHUNK):
+            chunk = missing[i:i + QUERY_CHUNK]
+            try:
+                found = await guild.query_members(user_ids=chunk, limit=len(chunk), cache=True)
+            except Exception as e:
+                # 問い合わせできない（intent なし・タイムアウトなど）ときは ID 表示のまま。失敗は覚えない
+                print(f"[members] query failed: {e}")
+                break
+            got = {m.id: m.display_name for m in found}
+            for uid in chunk:
+                self._store(guild.id, uid, got.get(uid), now)
+            names.update(got)
+        return names
+
+
+MEMBER_NAMES = MemberNameResolver()
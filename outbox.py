@@ -0,0 +1,148 @@
+# outbox.py
+import time
+import asyncio
+from collections import deque
+from config import OUTBOX_RATE, OUTBOX_BURST, OUTBOX_MAX_LENGTH
+
+# 送信メッセージの出口。チャンネルごとにキューを持ち、トークンバケットで送る速さを抑える。
+# - post() はキューに積むだけで、ハンドラは送信完了（や 429 の待ち）を待たない
+# - 同じチャンネル宛てに溜まっている短い返信は、2000文字に収まる分だけ1通にまとめて送る
+# - 1通で 2000文字を超える返信は、積むときに改行の位置で分けておく（改行のない長い行はその場で切る）
+# - 送る順番はチャンネルごとに積んだ順のまま
+# - キューに積んでから実際に送るまでの待ち時間を stats() で見られる
+# - 送信役のタスクはチャンネルのキューが空になったら終わる（使われていないチャンネルには残らない）
+#   バケットの残量だけは満タンに戻るまで覚えておく（キューを作り直してもペースは守られる）
+
+
+class _ChannelQueue:
+    __slots__ = ("channel", "items", "tokens", "stamp", "task")
+
+    def __init__(self, channel, tokens: float, stamp: float):
+        self.channel = channel
+        self.items = deque()   # (本文, 積んだ時刻)
+        self.tokens = tokens
+        self.stamp = stamp
+        self.task = None
+
+
+class Outbox:
+    def __init__(self, rate: float = OUTBOX_RATE, burst: float = OUTBOX_BURST, max_length: int = OUTBOX_MAX_LENGTH):
+        self.rate = rate            # 1チャンネルあたり毎秒何通まで
+        self.burst = burst          # まとめて送れる通数
+        self.max_length = max_length
+        self._queues = {}           # channel.id -> _ChannelQueue
+        self._idle = {}             # キューを片付けたチャンネルのバケット channel.id -> (残量, 時刻)
+        # 統計
+        self.posted = 0             # 積まれた返信の数
+        self.sent = 0               # 実際に送った通数（まとめた分は1通）
+        self.merged = 0             # ほかの返信とまとめて送った数
+        self.failed = 0
+        self.waited = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # --- 積む ---
+    def post(self, channel, text: str) -> None:
+        if not text: return
+        q = self._queues.get(channel.id)
+        if q is None:
+            tokens, stamp = self._idle.pop(channel.id, (self.burst, time.monotonic()))
+            q = self._queues[channel.id] = _ChannelQueue(channel, tokens, stamp)
+        now = time.monotonic()
+        for part in self._split(text):
+            q.items.append((part, now))
+        self.posted += 1
+        if q.task is None or q.task.done():
+            q.task = asyncio.get_running_loop().create_task(self._run(channel.id, q))
+
+    def _split(self, text: str) -> list:
+        """max_length を超える返信を、改行の位置で max_length 以下に分ける"""
+        if len(text) <= self.max_length: return [text]
+        parts, cur = [], None
+        for line in text.split("\n"):
+            while len(line) > self.max_length:
+                if cur is not None: parts.append(cur)
+                parts.append(line[:self.max_length])
+                cur, line = None, line[self.max_length:]
+            if cur is not None and len(cur) + 1 + len(line) > self.max_length:
+                parts.append(cur)
+                cur = None
+            cur = line if cur is None else f"{cur}\n{line}"
+        if cur: parts.append(cur)
+        return parts
+
+    def pending(self) -> int:
+        return sum(len(q.items) for q in self._queues.values())
+
+    # --- 送る ---
+    async def _take_token(self, q: _ChannelQueue) -> None:
+        while True:
+            now = time.monotonic()
+            q.tokens = min(self.burst, q.tokens + (now - q.stamp) * self.rate)
+            q.stamp = now
+            if q.tokens >= 1:
+                q.tokens -= 1
+                return
+            await asyncio.sleep((1 - q.tokens) / self.rate)
+
+    def _merge(self, q: _ChannelQueue):
+        """先頭から、まとめて max_length に収まる分を取り出す"""
+        text, stamp = q.items.popleft()
+        parts, stamps, size = [text], [stamp], len(text)
+        while q.items and size + 1 + len(q.items[0][0]) <= self.max_length:
+            nxt, st = q.items.popleft()
+            parts.append(nxt)
+            stamps.append(st)
+            size += 1 + len(nxt)
+        self.merged += len(parts) - 1
+        return "\n".join(parts), stamps
+
+    async def _run(self, key, q: _ChannelQueue) -> None:
+        try:
+            while q.items:
+                await self._take_token(q)
+                # トークン待ちのあいだに積まれた分もまとめる
+                text, stamps = self._merge(q)
+                now = time.monotonic()
+                for st in stamps:
+                    self.waited += 1
+                    self.wait_total += now - st
+                    self.wait_max = max(self.wait_max, now - st)
+                try:
+                    await q.channel.send(text)
+                    self.sent += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"[outbox] send failed: channel={key}: {e}")
+        finally:
+            if not q.items and self._queues.get(key) is q:
+                del self._queues[key]
+                self._idle[key] = (q.tokens, q.stamp)
+                self._prune_idle()
+
+    def _prune_idle(self) -> None:
+        # 満タンまで戻ったバケットは覚えておく必要がない
+        full_after = self.burst / self.rate
+        now = time.monotonic()
+        for key in [k for k, (_, st) in self._idle.items() if now - st >= full_after]:
+            del self._idle[key]
+
+    async def drain(self, timeout: float = None) -> None:
+        """積まれている分を送り終わるまで待つ（終了時など）"""
+        tasks = [q.task for q in self._queues.values() if q.task is not None and not q.task.done()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def stats(self) -> dict:
+        return {
+            "posted": self.posted,
+            "sent": self.sent,
+            "merged": self.merged,
+            "failed": self.failed,
+            "pending": self.pending(),
+            "wait_avg": self.wait_total / max(1, self.waited),
+            "wait_max": self.wait_max,
+        }
+
+
+OUTBOX = Outbox()
@@ -0,0 +1,60 @@
+# overrides.py
+import time
+from storage import get_store
+from config import OVERRIDES_FILE
+
+# 全体 / サーバー単位の一括設定（全体ミュリオンモード、一括変身など）を持つモジュール。
+# - 全員分のレコードを書き換える代わりに、スコープごとに1件だけ上書き設定を置く
+# - 参照時はユーザー個別の値と上書き設定を見比べ、「あとから設定された方」を使う
+#   （一括変更のあとに本人が変えた値は生きる。まだレコードのない新規ユーザーにも効く）
+# - 形式: {"global": {"myurion": [値, 設定時刻]}, "guild:123": {"form": ["aglaia", 設定時刻]}}
+
+_overrides = get_store(OVERRIDES_FILE)
+
+
+def _scope_key(guild_id=None) -> str:
+    return "global" if guild_id is None else f"guild:{int(guild_id)}"
+
+
+def now() -> float:
+    """個別の値・上書き設定に付ける設定時刻"""
+    return time.time()
+
+
+def set_override(key: str, value, guild_id=None) -> None:
+    """スコープ（guild_id なしなら全体）に上書き設定を置く。既存の個別設定より優先される"""
+    scope = _scope_key(guild_id)
+    entry = dict(_overrides.get(scope, {}))
+    entry[key] = [value, now()]
+    _overrides.set(scope, entry)
+
+
+def clear_override(key: str, guild_id=None) -> bool:
+    scope = _scope_key(guild_id)
+    entry = dict(_overrides.get(scope, {}))
+    if key not in entry: return False
+    del entry[key]
+    _overrides.set(scope, entry)
+    return True
+
+
+def get_override(key: str, guild_id=None):
+    """[値, 設定時刻] か None"""
+    entry = _overrides.get(_scope_key(guild_id), {})
+    item = entry.get(key) if isinstance(entry, dict) else None
+    if isinstance(item, list) and len(item) == 2:
+        return item
+    return None
+
+
+def resolve(key: str, own_value, own_at: float = 0.0, guild_id=None):
+    """
+    個別の値（own_value, 設定時刻 own_at）と全体・サーバーの上書き設定のうち、いちばん新しいものを返す。
+    設定時刻のない個別の値（一括設定より前からあるもの）は 0 扱い。
+    """
+    value, at = own_value, own_at or 0.0
+    for scope_id in (None, guild_id) if guild_id is not None else (None,):
+        item = get_override(key, scope_id)
+        if item is not None and item[1] > at:
+            value, at = item
+    return value
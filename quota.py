@@ -0,0 +1,68 @@
+# quota.py
+import database as db
+from config import today_str
+
+# 1日あたりのメッセージ回数制限（メッセージ制限編集で設定したもの）。
+# - カウンタはメモリの {user_id: 回数}。対象は制限が設定されているユーザーだけ
+# - 日付（JST）が変わったらカウンタの dict ごと取り替える（全員を見て回らない）
+# - 各ユーザーの今日の回数は、その日最初のメッセージのときに message_usage から読む
+# - 書き戻しは flush() でまとめて（変わったユーザーの分だけ）
+
+
+class MessageQuota:
+    def __init__(self):
+        self._day = None
+        self._counts = {}     # user_id -> 今日の回数
+        self._dirty = set()   # 書き戻していない user_id
+        self._notified = set()  # 今日すでに「上限です」と伝えた user_id
+
+    def _rollover(self) -> str:
+        today = today_str()
+        if today != self._day:
+            self._day = today
+            self._counts, self._dirty, self._notified = {}, set(), set()
+        return today
+
+    def _count(self, user_id: int) -> int:
+        count = self._counts.get(user_id)
+        if count is None:
+            rec = db.load_message_usage().get(str(user_id))
+            count = int(rec.get("count", 0)) if isinstance(rec, dict) and rec.get("date") == self._day else 0
+            self._counts[user_id] = count
+        return count
+
+    def usage(self, user_id: int) -> int:
+        self._rollover()
+        return self._count(user_id)
+
+    def is_over(self, user_id: int) -> bool:
+        limit = db.get_message_limit(user_id)
+        if limit is None or limit <= 0: return False
+        return self.usage(user_id) >= limit
+
+    def consume(self, user_id: int) -> bool:
+        """1回分を数える。上限に達していたら数えずに False（bypass 対象は常に True）"""
+        limit = db.get_message_limit(user_id)
+        if limit is None or limit <= 0 or db.can_bypass_message_limit(user_id): return True
+        self._rollover()
+        count = self._count(user_id)
+        if count >= limit: return False
+        self._counts[user_id] = count + 1
+        self._dirty.add(user_id)
+        return True
+
+    def first_rejection(self, user_id: int) -> bool:
+        """上限に達してから今日はじめての拒否か（お知らせは1日1回だけ返す）"""
+        if user_id in self._notified: return False
+        self._notified.add(user_id)
+        return True
+
+    def flush(self) -> int:
+        """変わった分を message_usage に書き戻し、件数を返す"""
+        dirty, self._dirty = self._dirty, set()
+        for uid in dirty:
+            db.set_message_usage(uid, self._day, self._counts.get(uid, 0))
+        return len(dirty)
+
+
+QUOTA = MessageQuota()
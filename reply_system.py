@@ -1,121 +1,160 @@
 import random
-import database as db
+import inspect
+import importlib
 import lines as lines_cyrene
+from templates import render, compile_corpus
+from storage import run_io
 
-# 各キャラのモジュールをインポート
-import lines_aglaia, lines_trisbeas, lines_anaxagoras
-import lines_hyacinthia, lines_medimos, lines_sepharia, lines_castoris
-import lines_phainon_kasreina, lines_electra, lines_cerydra
-import lines_nanoka, lines_danheng, lines_furina, lines_momo
-
+# フォームキー → セリフモジュール名。
+# モジュールはそのフォームが初めて使われるときに読み込む（ほとんどの人はキュレネのまま）。
+# セリフモジュールは大きいので、読み込みは aload() で I/O スレッドに任せる（ループを止めない）。
 MODULE_MAP = {
-    "cyrene": lines_cyrene,
-    "aglaia": lines_aglaia,
-    "trisbeas": lines_trisbeas,
-    "anaxagoras": lines_anaxagoras,
-    "hyacinthia": lines_hyacinthia,
-    "medimos": lines_medimos,
-    "sepharia": lines_sepharia,
-    "castoris": lines_castoris,
-    "phainon_kasreina": lines_phainon_kasreina,
-    "electra": lines_electra,
-    "cerydra": lines_cerydra,
-    "nanoka": lines_nanoka,
-    "danheng": lines_danheng,
-    "furina": lines_furina,
-    "momo": lines_momo,
+    "cyrene": "lines",
+    "aglaia": "lines_aglaia",
+    "trisbeas": "lines_trisbeas",
+    "anaxagoras": "lines_anaxagoras",
+    "hyacinthia": "lines_hyacinthia",
+    "medimos": "lines_medimos",
+    "sepharia": "lines_sepharia",
+    "castoris": "lines_castoris",
+    "phainon_kasreina": "lines_phainon_kasreina",
+    "electra": "lines_electra",
+    "cerydra": "lines_cerydra",
+    "nanoka": "lines_nanoka",
+    "danheng": "lines_danheng",
+    "furina": "lines_furina",
+    "momo": "lines_momo",
 }
 
-def generate_reply_for_form(form_key: str, message_text: str, affection_level: int, user_id: int, name: str) -> str:
-    module = MODULE_MAP.get(form_key, lines_cyrene)
-    
-    if hasattr(module, "get_reply"):
-        try:
-            # ★優先1: 最新の形式（本文, 好感度, 名前）で呼び出す
-            # ヒアシンシア、ケリュドラなどはこっち
-            base = module.get_reply(message_text, affection_level, name)
-        except TypeError:
-            try:
-                # ★優先2: 従来の形式（本文, 好感度）で呼び出す
-                # まだ修正していない他のキャラはこっち
-                base = module.get_reply(message_text, affection_level)
-            except TypeError:
-                # ★優先3: さらに古い形式（本文のみ）
-                base = module.get_reply(message_text)
-    else:
-        base = lines_cyrene.get_cyrene_reply(message_text, affection_level)
-
-    if name:
-        # モジュール側で対応していても、念のためここでも置換を実行しておく（安全策）
-        base = base.replace("「あだ名」", f"「{name}」").replace("あだ名", name).replace("{nickname}", name).replace("{name}", name)
-    return base
+# --- 返信バンク ---
+# lines_* モジュールは書かれた時期によって形がばらばら
+# （get_reply の引数が 1〜3 個、PROFILE / CHAR_PROFILE、get_nickname_line / get_rps_flavor の有無）。
+# モジュールを読み込んだときに一度だけ調べて ReplyBank に包み、返信ごとの呼び出しは直接1回で済ませる。
+
+def _positional_arity(func) -> int:
+    """func が受け取れる位置引数の数（*args があれば大きな数）"""
+    n = 0
+    for p in inspect.signature(func).parameters.values():
+        if p.kind == p.VAR_POSITIONAL: return 99
+        if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD): n += 1
+    return n
+
+
+def _adapt(func, max_args: int):
+    """func を「先頭 max_args 個の引数で呼ぶ関数」にそろえる（余る引数は渡さない）"""
+    n = min(_positional_arity(func), max_args)
+    return lambda *args: func(*args[:n])
+
+
+class ReplyBank:
+    """1フォーム分のセリフ。どのモジュールでも同じメソッドで呼べる"""
+
+    def __init__(self, form_key: str, module):
+        self.form_key = form_key
+        self.lines = getattr(module, "LINES", None) or {}
+        # セリフはここで一度だけテンプレートにしておく（以降の描画は join 1回）
+        for corpus in ("LINES", "CYRENE_LINES", "HIGH_AFFECTION_LINES"):
+            compile_corpus(getattr(module, corpus, None) or {})
+
+        if hasattr(module, "PROFILE"):
+            profile = module.PROFILE
+            self.pronoun = profile.get("first_person", "あたし")
+        else:
+            profile = getattr(module, "CHAR_PROFILE", {})
+            self.pronoun = profile.get("pronoun", "あたし")
+        self.rps_tail = profile.get("rps_tail", "わ♡")
+
+        get_reply = getattr(module, "get_reply", lines_cyrene.get_cyrene_reply)
+        self._reply = _adapt(get_reply, 3)         # (本文, 好感度, 名前)
+        # 名前を受け取るモジュールは自分で埋め込むので、こちらでは描画しない
+        self._reply_renders_name = _positional_arity(get_reply) >= 3
+        get_nickname = getattr(module, "get_nickname_line", None)
+        get_flavor = getattr(module, "get_rps_flavor", None)
+        self._nickname = _adapt(get_nickname, 2) if get_nickname else None
+        self._rps_flavor = _adapt(get_flavor, 2) if get_flavor else None
+        # こちらも名前を受け取らない関数の分は、返ってきたセリフにこちらで名前を差し込む
+        self._nickname_renders_name = bool(get_nickname) and _positional_arity(get_nickname) >= 2
+        self._rps_flavor_renders_name = bool(get_flavor) and _positional_arity(get_flavor) >= 2
+
+    def reply(self, message_text: str, affection_level: int, name: str) -> str:
+        text = self._reply(message_text, affection_level, name)
+        return text if self._reply_renders_name else render(text, name)
+
+    def nickname_line(self, action: str, name: str = "") -> str:
+        if self._nickname is not None:
+            text = self._nickname(action, name)
+            return text if self._nickname_renders_name else render(text, name)
+        if action == "ask": return "あたし、どう呼べばいいの？"
+        elif action == "confirm": return f"ふふ…これからは「{name}」って呼ぶわね♪"
+        return ""
+
+    def rps_flavor(self, result: str, name: str) -> str:
+        if self._rps_flavor is not None:
+            text = self._rps_flavor(result, name)
+            return text if self._rps_flavor_renders_name else render(text, name)
+        choices = self.lines.get(f"rps_{result}")
+        if choices:
+            return render(random.choice(choices), name)
+        return lines_cyrene.get_rps_line(result)
+
+    def rps_prompt(self, name: str) -> str:
+        choices = self.lines.get("rps_start")
+        if choices:
+            return render(random.choice(choices), name)
+        # デフォルト（キュレネ）
+        return "じゃんけんをしましょう♪ グー / チョキ / パー、どれにするかしら？"
+
+
+BANKS = {"cyrene": ReplyBank("cyrene", lines_cyrene)}
+
+
+def get_bank(form_key: str) -> ReplyBank:
+    bank = BANKS.get(form_key)
+    if bank is None:
+        name = MODULE_MAP.get(form_key)
+        if name is None:
+            return BANKS["cyrene"]
+        bank = BANKS[form_key] = ReplyBank(form_key, importlib.import_module(name))
+    return bank
+
+
+def warmup(form_keys) -> None:
+    """よく使うフォームを先に読み込んでおく（起動直後の初回返信を速くしたいとき用）"""
+    for key in form_keys:
+        if key in MODULE_MAP:
+            get_bank(key)
+
+
+def is_loaded(form_key: str) -> bool:
+    return form_key in BANKS or form_key not in MODULE_MAP
+
+
+async def aload(form_keys) -> None:
+    """未読み込みのフォームを I/O スレッドで読み込む（読み込み済みなら何もしない）"""
+    keys = [k for k in form_keys if not is_loaded(k)]
+    if keys:
+        await run_io(warmup, keys)
+
+
+# --- 呼び出し口 ---
+def generate_reply_for_form(ctx, message_text: str) -> str:
+    return get_bank(ctx.form).reply(message_text, ctx.level, ctx.name)
 
 def get_nickname_message_for_form(form_key: str, action: str, name: str = "") -> str:
-    module = MODULE_MAP.get(form_key, lines_cyrene)
-    
-    if hasattr(module, "get_nickname_line"):
-        try:
-            # ★修正: 名前引数ありを優先
-            line = module.get_nickname_line(action, name)
-        except TypeError:
-            # 引数なしの旧バージョン
-            line = module.get_nickname_line(action)
-        return line.replace("{name}", name)
-    
-    if action == "ask": return "あたし、どう呼べばいいの？"
-    elif action == "confirm": return f"ふふ…これからは「{name}」って呼ぶわね♪"
-    return ""
+    return get_bank(form_key).nickname_line(action, name)
 
 def get_rps_flavor(form_key: str, result: str, name: str) -> str:
-    module = MODULE_MAP.get(form_key, lines_cyrene)
-    
-    # もしモジュールに専用の関数があれば、そちらを優先的に試す（新しい形式への対応）
-    if hasattr(module, "get_rps_flavor"):
-        try:
-            return module.get_rps_flavor(result, name)
-        except TypeError:
-            pass # 引数が合わなければ下のLINES取得処理へ進む
-
-    if hasattr(module, "LINES"):
-        lines_dict = module.LINES
-        key = f"rps_{result}"
-        if key in lines_dict and lines_dict[key]:
-            base = random.choice(lines_dict[key])
-            return base.replace("{nickname}", name).replace("{name}", name)
-            
-    return lines_cyrene.get_rps_line(result)
+    return get_bank(form_key).rps_flavor(result, name)
 
 # ★ここが重要：じゃんけん開始時のセリフ
 def get_rps_prompt_for_form(form_key: str, name: str) -> str:
-    module = MODULE_MAP.get(form_key, lines_cyrene)
-    
-    # 各キャラファイルの LINES["rps_start"] を優先
-    if hasattr(module, "LINES"):
-        lines_dict = module.LINES
-        if "rps_start" in lines_dict and lines_dict["rps_start"]:
-            base = random.choice(lines_dict["rps_start"])
-            return base.replace("{nickname}", name).replace("{name}", name)
-    
-    # デフォルト（キュレネ）
-    return "じゃんけんをしましょう♪ グー / チョキ / パー、どれにするかしら？"
+    return get_bank(form_key).rps_prompt(name)
 
 def format_rps_result(form_key: str, name: str, user_hand: str, bot_hand: str, flavor: str, wins: int) -> str:
-    module = MODULE_MAP.get(form_key, lines_cyrene)
-    
-    pronoun = "あたし"
-    tail = "わ♡"
-    
-    if hasattr(module, "PROFILE"): # CHAR_PROFILE -> PROFILE に統一されている場合が多いので変更を推奨
-        profile = module.PROFILE
-        pronoun = profile.get("first_person", pronoun) # "pronoun" or "first_person"
-        tail = profile.get("rps_tail", tail)
-    elif hasattr(module, "CHAR_PROFILE"):
-        profile = module.CHAR_PROFILE
-        pronoun = profile.get("pronoun", pronoun)
-        tail = profile.get("rps_tail", tail)
-        
+    bank = get_bank(form_key)
+    pronoun, tail = bank.pronoun, bank.rps_tail
     return (
         f"{name} は **{user_hand}**、{pronoun}は **{bot_hand}** だ。\n"
         f"{flavor}\n"
         f"（これまでに {wins} 回、{pronoun}に勝っている{tail}）"
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,108 @@
+# router.py
+from dataclasses import dataclass
+import triggers
+
+# on_message のコマンド振り分け用ルーター。
+# - exact   : 本文が完全一致（dict を1回引くだけ）
+# - prefix  : 本文の先頭一致（「あだ名登録 ○○」など）
+# - contains: 本文のどこかに含まれる（「10連ガチャ」の「ガチャ」など）
+# - state   : ユーザーの会話状態（sessions.SessionState。あだ名入力待ちなど）で拾う
+# - when    : それ以外の条件で拾う（本文の正規化が必要なものなど）
+# 候補は「完全一致の1回の辞書引き + トリガー文字列の1回の走査（triggers.scan）+ 状態の1回の辞書引き」で集め、
+# 登録順（= 優先順）に試す。ハンドラが False を返したら次の候補へ回す。
+
+
+@dataclass
+class Request:
+    message: object
+    ctx: object
+    text: str                     # メンション除去後の本文
+    hits: frozenset = None        # 本文に含まれていたトリガー（triggers.scan の結果）
+    session: object = None        # 進行中のセッション（sessions.Session）。なければ None
+
+    @property
+    def state(self):
+        return self.session.state if self.session is not None else None
+
+    @property
+    def user_id(self) -> int:
+        return self.ctx.user_id
+
+    @property
+    def mention(self) -> str:
+        return self.message.author.mention
+
+
+@dataclass(eq=False)
+class Route:
+    order: int
+    handler: object
+    exact: tuple = ()
+    prefix: tuple = ()
+    contains: tuple = ()
+    state: tuple = ()
+    when: object = None   # (req) -> bool。パターンとは OR で効く
+    guard: object = None  # (req) -> bool。マッチしたあとに AND で効く（管理者限定など）
+
+
+class Router:
+    def __init__(self):
+        self._routes = []
+        self._exact = {}       # 本文 -> [Route]
+        self._triggers = {}    # トリガー文字列 -> ([prefix の Route], [contains の Route])
+        self._states = {}      # 会話状態 -> [Route]
+        self._conditional = [] # when を持つ Route
+        self._fallback = None
+
+    # --- 登録 ---
+    def route(self, exact=(), prefix=(), contains=(), state=(), when=None, guard=None):
+        """デコレータ。登録した順番がそのまま優先順位になる"""
+        if not isinstance(state, (tuple, list, set, frozenset)): state = (state,)
+        def deco(handler):
+            r = Route(len(self._routes), handler, tuple(exact), tuple(prefix), tuple(contains), tuple(state), when, guard)
+            self._routes.append(r)
+            for t in r.exact:
+                self._exact.setdefault(t, []).append(r)
+            for t in triggers.register(*r.prefix):
+                self._triggers.setdefault(t, ([], []))[0].append(r)
+            for t in triggers.register(*r.contains):
+                self._triggers.setdefault(t, ([], []))[1].append(r)
+            for st in r.state:
+                self._states.setdefault(st, []).append(r)
+            if when is not None:
+                self._conditional.append(r)
+            return handler
+        return deco
+
+    def fallback(self, handler):
+        """どのルートにも当たらなかったとき（通常会話）"""
+        self._fallback = handler
+        return handler
+
+    # --- 照合 ---
+    def candidates(self, req: Request) -> list:
+        text = req.text
+        found = set(self._exact.get(text, ()))
+        if req.session is not None:
+            found.update(self._states.get(req.session.state, ()))
+        for t in req.hits:
+            entry = self._triggers.get(t)
+            if entry is None: continue
+            prefix_routes, contains_routes = entry
+            found.update(contains_routes)
+            if prefix_routes and text.lower().startswith(t):
+                found.update(prefix_routes)
+        found.update(r for r in self._conditional if r not in found and r.when(req))
+        return sorted(found, key=lambda r: r.order)
+
+    async def dispatch(self, req: Request) -> bool:
+        if req.hits is None:
+            req.hits = triggers.scan(req.text)
+        for r in self.candidates(req):
+            if r.guard is not None and not r.guard(req): continue
+            if await r.handler(req) is not False:
+                return True
+        if self._fallback is not None:
+            await self._fallback(req)
+            return True
+        return False
@@ -0,0 +1,104 @@
+# scheduler.py
+import time
+import heapq
+import traceback
+import asyncio
+from config import INBOUND_WORKERS, INBOUND_MAX_QUEUE, INBOUND_SHED_AT
+
+# 受け取ったメッセージの処理待ち行列。on_message は振り分けだけして、ここに積む。
+# - 決まった数のワーカーが優先度順（数字が小さいほど先）に取り出して処理する
+# - 行列は INBOUND_MAX_QUEUE 件まで。満杯なら、いちばん優先度の低いもの（同じなら新しい方）を捨てる
+# - 行列が INBOUND_SHED_AT 以上溜まっているあいだは degraded が True になり、
+#   ハンドラ側で重い処理（好感度XP・ミュリオン変換など）を省く
+
+PRIORITY_ADMIN = 0    # 管理者・データ管理モード
+PRIORITY_SESSION = 1  # 入力待ちへの返事（じゃんけんの手・クイズの答えなど）
+PRIORITY_COMMAND = 2  # コマンド・キーワード
+PRIORITY_CHAT = 3     # メンションだけの雑談
+
+
+class InboundScheduler:
+    def __init__(self, workers: int = INBOUND_WORKERS, max_queue: int = INBOUND_MAX_QUEUE, shed_at: int = INBOUND_SHED_AT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.shed_at = shed_at
+        self._heap = []        # (優先度, 通し番号, 積んだ時刻, ハンドラ, 引数)
+        self._seq = 0
+        self._ready = asyncio.Event()
+        self._tasks = []
+        self._active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # 統計
+        self.accepted = 0
+        self.dropped = 0
+        self.shed = 0          # degraded で処理したメッセージの数
+        self.wait_max = 0.0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    @property
+    def degraded(self) -> bool:
+        return len(self._heap) >= self.shed_at
+
+    # --- 積む ---
+    def submit(self, priority: int, handler, *args) -> bool:
+        """handler(*args, degraded) を積む。捨てたら False"""
+        if len(self._heap) >= self.max_queue:
+            # 満杯なら、積まれている中でいちばん後回しになるもの（優先度が低く、新しいもの）と比べて
+            # 新しい方が勝てばそれを捨てて入れ替え、勝てなければ新しい方を捨てる
+            worst = max(range(len(self._heap)), key=lambda i: self._heap[i][:2])
+            self.dropped += 1
+            if priority >= self._heap[worst][0]:
+                return False
+            self._heap[worst] = self._heap[-1]
+            self._heap.pop()
+            heapq.heapify(self._heap)
+        self._seq += 1
+        heapq.heappush(self._heap, (priority, self._seq, time.monotonic(), handler, args))
+        self.accepted += 1
+        self._idle.clear()
+        self._ready.set()
+        return True
+
+    # --- ワーカー ---
+    def start(self) -> None:
+        if self._tasks: return
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self) -> None:
+        while True:
+            while not self._heap:
+                self._ready.clear()
+                await self._ready.wait()
+            degraded = self.degraded
+            _, _, stamp, handler, args = heapq.heappop(self._heap)
+            self.wait_max = max(self.wait_max, time.monotonic() - stamp)
+            if degraded: self.shed += 1
+            self._active += 1
+            try:
+                await handler(*args, degraded)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._active -= 1
+                if not self._heap and not self._active:
+                    self._idle.set()
+
+    async def join(self, timeout: float = None) -> None:
+        """積まれている分を処理し終わるまで待つ（終了時など）"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[scheduler] join timed out: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._heap), "active": self._active, "accepted": self.accepted,
+            "dropped": self.dropped, "shed": self.shed, "wait_max": self.wait_max,
+        }
+
+
+SCHEDULER = InboundScheduler()
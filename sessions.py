@@ -0,0 +1,186 @@
+# sessions.py
+import json
+import time
+from enum import Enum
+from dataclasses import dataclass, field
+from config import SESSION_TTL, SESSION_ADMIN_TTL, SESSION_TICK
+from storage import atomic_write_text
+
+# ユーザーごとの「会話の途中状態」（あだ名入力待ち、じゃんけんの手待ちなど）をまとめて持つ。
+# - 1ユーザーにつき1セッション（状態 + 付随データ + 期限）
+# - 期限切れはタイマーホイールで定期的に掃除する（放置されたセッションが溜まらないように）
+# - 参照時にも期限を見るので、掃除の前でも期限切れは「セッションなし」として扱う
+# - 再起動をまたげるよう /data/sessions.json に定期的・終了時に書き出す
+#   形式は {"user_id": ["状態", 期限(UNIX秒), {付随データ}]}（付随データが空なら省略）
+# - 起動時の復元: ファイルの読み込みと解析は I/O スレッドで（read_snapshot）、
+#   各ユーザーの分はそのユーザーの参照時に組み立てる
+
+
+class SessionState(Enum):
+    NICKNAME = "nickname"              # あだ名入力待ち
+    RPS_CHOICE = "rps_choice"          # じゃんけんの手待ち
+    TRANSFORM_CODE = "transform_code"  # 変身コード待ち
+    MYURION_QUIZ = "myurion_quiz"      # ミュリオンクイズの回答待ち
+    ADMIN = "admin"                    # データ管理モード
+    ADMIN_ADD = "admin_add"            # データ管理モード：管理者追加の対象待ち
+    ADMIN_REMOVE = "admin_remove"      # データ管理モード：管理者削除の対象待ち
+    GUARDIAN_LEVEL = "guardian_level"  # データ管理モード：親衛隊レベル入力待ち
+    MSG_LIMIT = "msg_limit"            # データ管理モード：メッセージ制限入力待ち
+
+
+# データ管理モード中とみなす状態
+ADMIN_STATES = frozenset({
+    SessionState.ADMIN, SessionState.ADMIN_ADD, SessionState.ADMIN_REMOVE,
+    SessionState.GUARDIAN_LEVEL, SessionState.MSG_LIMIT,
+})
+
+
+@dataclass
+class Session:
+    state: SessionState
+    payload: dict = field(default_factory=dict)
+    deadline: float = 0.0
+
+
+class SessionManager:
+    """dict[user_id, Session] + 期限切れ掃除用のタイマーホイール"""
+
+    def __init__(self, tick: float = SESSION_TICK, span: float = SESSION_ADMIN_TTL):
+        self._sessions = {}
+        self._tick = tick
+        # 最長の TTL が1周に収まる数のスロット。各スロットには「その頃に期限が来る user_id」を入れる
+        self._wheel = [set() for _ in range(int(span // tick) + 2)]
+        self._cursor = int(time.time() // tick)
+        self._dirty = False
+        self._pending = {}         # 復元済みだがまだ組み立てていないエントリ {"user_id": [...]}
+
+    def __len__(self) -> int:
+        return len(self._sessions) + len(self._pending)
+
+    def __contains__(self, user_id) -> bool:
+        return self.get(user_id) is not None
+
+    # --- 参照 ---
+    def get(self, user_id: int):
+        if self._pending:
+            self._revive(user_id)
+        s = self._sessions.get(user_id)
+        if s is not None and s.deadline <= time.time():
+            del self._sessions[user_id]
+            self._dirty = True
+            return None
+        return s
+
+    def state(self, user_id: int):
+        s = self.get(user_id)
+        return s.state if s is not None else None
+
+    # --- 変更 ---
+    def start(self, user_id: int, state: SessionState, payload: dict = None, ttl: float = None) -> Session:
+        """セッションを開始（既存のセッションは置き換える）"""
+        if ttl is None:
+            ttl = SESSION_ADMIN_TTL if state in ADMIN_STATES else SESSION_TTL
+        s = Session(state, payload or {}, time.time() + ttl)
+        self._pending.pop(str(user_id), None)
+        self._sessions[user_id] = s
+        self._dirty = True
+        self._schedule(user_id, s.deadline)
+        return s
+
+    def end(self, user_id: int, state: SessionState = None) -> None:
+        """セッションを終了。state を渡したときは、その状態のときだけ終了する"""
+        s = self.get(user_id)
+        if s is not None and (state is None or s.state == state):
+            del self._sessions[user_id]
+            self._dirty = True
+        # ホイール側はそのまま（掃除のときに本体を見て読み飛ばす）
+
+    # --- 期限切れ掃除 ---
+    def _schedule(self, user_id: int, deadline: float) -> None:
+        slot = max(int(deadline // self._tick), self._cursor + 1)
+        slot = min(slot, self._cursor + len(self._wheel) - 1)
+        self._wheel[slot % len(self._wheel)].add(user_id)
+
+    def tick(self, now: float = None) -> int:
+        """前回から今までのスロットを処理し、期限切れのセッションを消す。消した数を返す"""
+        now = time.time() if now is None else now
+        target = int(now // self._tick)
+        expired = 0
+        # 長く止まっていたときも、ホイールを1周すれば全スロットを見たことになる
+        self._cursor = max(self._cursor, target - len(self._wheel))
+        while self._cursor < target:
+            self._cursor += 1
+            bucket = self._wheel[self._cursor % len(self._wheel)]
+            if not bucket: continue
+            uids, bucket_new = list(bucket), set()
+            bucket.clear()
+            for uid in uids:
+                s = self._sessions.get(uid)
+                if s is None: continue
+                if s.deadline <= now:
+                    del self._sessions[uid]
+                    self._dirty = True
+                    expired += 1
+                else:
+                    # 延長・再開されたセッションは新しい期限のスロットへ入れ直す
+                    bucket_new.add(uid)
+            for uid in bucket_new:
+                self._schedule(uid, self._sessions[uid].deadline)
+        return expired
+
+
+    # --- 永続化 ---
+    @staticmethod
+    def read_snapshot(path) -> dict:
+        """保存したファイルを読んで解析する（I/O スレッドで呼ぶ）"""
+        try:
+            raw = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+        except Exception:
+            raw = {}
+        return raw if isinstance(raw, dict) else {}
+
+    def restore(self, raw: dict) -> None:
+        """read_snapshot の結果を復元待ちに登録する（組み立ては各ユーザーの参照時）"""
+        for key, entry in raw.items():
+            if not key.isdigit() or int(key) in self._sessions: continue
+            self._pending.setdefault(key, entry)
+
+    def _revive(self, user_id: int) -> None:
+        entry = self._pending.pop(str(user_id), None)
+        if entry is None or user_id in self._sessions: return
+        try:
+            state, deadline = SessionState(entry[0]), float(entry[1])
+            payload = entry[2] if len(entry) > 2 else {}
+        except (ValueError, TypeError, IndexError):
+            return
+        if deadline > time.time():
+            self._sessions[user_id] = Session(state, payload, deadline)
+            self._schedule(user_id, deadline)
+
+    def take_snapshot(self):
+        """変更があれば保存用の dict を返す（なければ None）。組み立て前のエントリもそのまま残す"""
+        if not self._dirty: return None
+        self._dirty = False
+        now = time.time()
+        out = {k: v for k, v in self._pending.items() if isinstance(v, list) and len(v) > 1 and v[1] > now}
+        for uid, s in self._sessions.items():
+            if s.deadline <= now: continue
+            entry = [s.state.value, int(s.deadline) + 1]
+            if s.payload: entry.append(s.payload)
+            out[str(uid)] = entry
+        return out
+
+    def write_snapshot(self, path, payload) -> None:
+        try:
+            atomic_write_text(path, json.dumps(payload, ensure_ascii=False, separators=(",", ":")))
+        except Exception as e:
+            self._dirty = True
+            print(f"[sessions] save failed: {path}: {e}")
+
+    def save(self, path) -> None:
+        payload = self.take_snapshot()
+        if payload is not None:
+            self.write_snapshot(path, payload)
+
+
+SESSIONS = SessionManager()
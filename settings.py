@@ -0,0 +1,163 @@
+# settings.py
+import json
+import time
+import threading
+from bisect import bisect_right
+from dataclasses import dataclass, field, replace
+from types import MappingProxyType
+from storage import atomic_write_text, run_io
+from config import AFFECTION_CONFIG_FILE, MESSAGE_LIMIT_CONFIG_FILE, CONFIG_RELOAD_INTERVAL
+
+# 管理者が編集する設定ファイル（好感度・メッセージ制限）を、検証済みの読み取り専用オブジェクトとして持つモジュール。
+# - get() はメモリ上の値を返すだけ（メッセージごとに呼ばれるので、ディスクは見ない）
+# - 読み込みと mtime の確認は arefresh_all() から I/O スレッドで行う（起動時と定期フラッシュのついで。
+#   mtime の確認は CONFIG_RELOAD_INTERVAL 秒に1回まで）
+# - 変更は新しいオブジェクトを作って await save() する（参照はすぐ新しい値になり、書き出しは I/O スレッドで）
+# - 壊れた値・型の違う値は項目ごとに既定値へ戻す
+
+
+# --- 好感度 ---
+DEFAULT_LEVEL_THRESHOLDS = (0, 0, 1000, 4000, 16000, 640000, 33350337)
+DEFAULT_XP_ACTIONS = {"talk": 3, "rps_win": 10, "rps_lose": 5, "rps_draw": 7}
+
+
+@dataclass(frozen=True)
+class AffectionConfig:
+    level_thresholds: tuple = DEFAULT_LEVEL_THRESHOLDS  # index = レベル、値 = そのレベルに必要な累計XP
+    xp_actions: MappingProxyType = field(default_factory=lambda: MappingProxyType(dict(DEFAULT_XP_ACTIONS)))
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "AffectionConfig":
+        th = raw.get("level_thresholds")
+        try:
+            th = tuple(int(v) for v in th)
+        except (TypeError, ValueError):
+            th = DEFAULT_LEVEL_THRESHOLDS
+        # 空・減っていく並びは二分探索できないので既定値に戻す
+        if not th or any(a > b for a, b in zip(th, th[1:])):
+            th = DEFAULT_LEVEL_THRESHOLDS
+        actions = dict(DEFAULT_XP_ACTIONS)
+        if isinstance(raw.get("xp_actions"), dict):
+            for k, v in raw["xp_actions"].items():
+                try: actions[str(k)] = int(v)
+                except (TypeError, ValueError): pass
+        return cls(th, MappingProxyType(actions))
+
+    def to_dict(self) -> dict:
+        return {"level_thresholds": list(self.level_thresholds), "xp_actions": dict(self.xp_actions)}
+
+    def level_for(self, xp: int) -> int:
+        if len(self.level_thresholds) <= 1: return 1
+        return max(1, bisect_right(self.level_thresholds, xp) - 1)
+
+    def xp_for(self, action: str, default: int = 0) -> int:
+        return self.xp_actions.get(action, default)
+
+    def with_threshold(self, level: int, xp: int) -> "AffectionConfig":
+        """Lv の必要XPを変えた設定。並びが崩れるなら ValueError"""
+        th = list(self.level_thresholds)
+        th[level] = int(xp)
+        if any(a > b for a, b in zip(th, th[1:])):
+            raise ValueError("level_thresholds must be non-decreasing")
+        return replace(self, level_thresholds=tuple(th))
+
+    def with_action(self, action: str, xp: int) -> "AffectionConfig":
+        return replace(self, xp_actions=MappingProxyType(dict(self.xp_actions, **{action: int(xp)})))
+
+
+# --- メッセージ制限 ---
+@dataclass(frozen=True)
+class MessageLimitConfig:
+    bypass_enabled: bool = False
+    allow_bypass_grant: bool = False
+    bypass_users: frozenset = frozenset()  # user_id（文字列）
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "MessageLimitConfig":
+        users = raw.get("bypass_users")
+        if not isinstance(users, (list, tuple)): users = ()
+        return cls(
+            bypass_enabled=bool(raw.get("bypass_enabled", False)),
+            allow_bypass_grant=bool(raw.get("allow_bypass_grant", False)),
+            bypass_users=frozenset(str(u) for u in users),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "bypass_enabled": self.bypass_enabled,
+            "allow_bypass_grant": self.allow_bypass_grant,
+            "bypass_users": sorted(self.bypass_users),
+        }
+
+    def can_bypass(self, user_id) -> bool:
+        return self.bypass_enabled and str(user_id) in self.bypass_users
+
+
+# --- 読み込み・再読み込み ---
+class ConfigFile:
+    """1ファイル = 1設定オブジェクト。mtime が変わったときだけ読み直す"""
+
+    def __init__(self, path, cls):
+        self.path = path
+        self.cls = cls
+        self._value = None
+        self._mtime = None
+        self._checked = 0.0
+        self._version = 0      # save するたびに増やす
+        self._lock = threading.Lock()
+
+    def _mtime_now(self):
+        try:
+            return self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read(self):
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8")) if self.path.exists() else {}
+        except Exception as e:
+            print(f"[settings] load failed: {self.path}: {e}")
+            raw = {}
+        return self.cls.from_dict(raw if isinstance(raw, dict) else {})
+
+    def _poll(self, force: bool = False):
+        """(値, mtime)。前回から変わっていなければ None（I/O スレッドで呼ぶ）"""
+        with self._lock:
+            mtime = self._mtime_now()
+            if not force and mtime == self._mtime: return None
+            return self._read(), mtime
+
+    def _write(self) -> None:
+        # 書き出すのはその時点の最新の値（save が続いても、最後に書かれるのは最後の値）
+        with self._lock:
+            atomic_write_text(self.path, json.dumps(self._value.to_dict(), ensure_ascii=False, indent=2))
+            self._mtime = self._mtime_now()
+
+    def get(self):
+        # 起動時の読み込みより前に呼ばれたときだけ、ここで読む
+        if self._value is None: self._value, self._mtime = self._poll(force=True)
+        return self._value
+
+    async def refresh(self) -> None:
+        now = time.monotonic()
+        if self._value is not None and now - self._checked < CONFIG_RELOAD_INTERVAL: return
+        self._checked = now
+        version = self._version
+        polled = await run_io(self._poll, self._value is None)
+        # 読んでいるあいだに save された値は上書きしない
+        if polled is not None and version == self._version:
+            self._value, self._mtime = polled
+
+    async def save(self, value) -> None:
+        self._version += 1
+        self._value = value
+        await run_io(self._write)
+
+
+AFFECTION_CONFIG = ConfigFile(AFFECTION_CONFIG_FILE, AffectionConfig)
+MESSAGE_LIMIT_CONFIG = ConfigFile(MESSAGE_LIMIT_CONFIG_FILE, MessageLimitConfig)
+CONFIG_FILES = (AFFECTION_CONFIG, MESSAGE_LIMIT_CONFIG)
+
+
+async def arefresh_all() -> None:
+    for conf in CONFIG_FILES: await conf.refresh()
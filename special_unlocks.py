@@ -1,19 +1,14 @@
 # special_unlocks.py
-import json
-from pathlib import Path
+from storage import get_store
+from config import SPECIAL_UNLOCKS_FILE
+import database as db
 
 # =====================
-# 永続保存ディレクトリ（Railwayの /data）
+# 永続保存先（Railwayの /data。ディレクトリは書き込み時に storage が作る）
 # =====================
-DATA_DIR = Path("/data")
-DATA_DIR.mkdir(exist_ok=True)
+FILE = SPECIAL_UNLOCKS_FILE
 
-FILE = DATA_DIR / "special_unlocks.json"
-
-DATA_DIR = Path("/data")
-DATA_DIR.mkdir(parents=True, exist_ok=True)
-
-MYURION_FILE = DATA_DIR / "myurion_mode.json"
+_unlocks = get_store(FILE)
 
 # =====================
 # デフォルト状態
@@ -25,80 +20,29 @@ _DEFAULT_STATE = {
     "danheng_unlocked": False, # 丹恒 解放済み
 }
 
-def set_all_myurion_enabled(value: bool = True):
-    data = _load_all()
-    for uid, state in data.items():
-        state["myurion_enabled"] = bool(value)
-        data[uid] = state
-    _save_all(data)
-
-def load_myurion_data() -> dict:
-    """ミュリオンモード用データを読み込み {user_id(str): {...}}"""
-    if not MYURION_FILE.exists():
-        return {}
-    try:
-        data = json.loads(MYURION_FILE.read_text(encoding="utf-8"))
-        if not isinstance(data, dict):
-            return {}
-        return data
-    except Exception:
-        return {}
-
-
-def save_myurion_data(data: dict):
-    """ミュリオンモード用データを保存"""
-    MYURION_FILE.write_text(
-        json.dumps(data, ensure_ascii=False, indent=2),
-        encoding="utf-8"
-    )
-
-
-def set_all_myurion_enabled(enabled: bool = True):
-    """
-    全ユーザーのミュリオンモード ON/OFF をまとめて切り替える。
-    - enabled=True なら全員「有効」
-    - enabled=False なら全員「無効」
-    """
-    data = load_myurion_data()
-    for uid, st in data.items():
-        if not isinstance(st, dict):
-            st = {}
-        st.setdefault("unlocked", False)
-
-        st["enabled"] = bool(enabled)
-        # 全体ONする場合は、まだ未解放でも強制的に解放扱いにする
-        if enabled and not st["unlocked"]:
-            st["unlocked"] = True
-
-        data[uid] = st
-
-    save_myurion_data(data)
+# ミュリオンモードの保存・一括切り替えは database 側にまとめてある（索引と上書き設定もそちらで持つ）
+load_myurion_data = db.load_myurion_data
+save_myurion_data = db.save_myurion_data
+
+
+def set_all_myurion_enabled(enabled: bool = True, guild_id=None):
+    """全ユーザー（guild_id を渡せばそのサーバー）のミュリオンモード ON/OFF。db.set_all_myurion_enabled と同じ"""
+    db.set_all_myurion_enabled(enabled, guild_id)
 
 
 # =====================
 # 内部ユーティリティ
 # =====================
 def _load_all() -> dict:
-    if not FILE.exists():
-        return {}
-    try:
-        return json.loads(FILE.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
+    return _unlocks.all()
 
 
 def _save_all(data: dict) -> None:
-    FILE.write_text(
-        json.dumps(data, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    _unlocks.replace(data)
 
 
 def _get_state_for(user_id: int) -> dict:
-    data = _load_all()
-    key = str(user_id)
-
-    state = data.get(key, {})
+    state = _unlocks.get(str(user_id), {})
     merged = _DEFAULT_STATE.copy()
     merged.update(state)
 
@@ -106,9 +50,21 @@ def _get_state_for(user_id: int) -> dict:
 
 
 def _set_state_for(user_id: int, state: dict) -> None:
-    data = _load_all()
-    data[str(user_id)] = state
-    _save_all(data)
+    _unlocks.set(str(user_id), state)
+
+
+def load_unlock_data() -> dict:
+    """全ユーザーの解放状態 {user_id(str): {...}}"""
+    return _load_all()
+
+
+def get_unlock_state(user_id: int) -> dict:
+    """デフォルトとマージ済みの状態（コピー）を返す"""
+    return _get_state_for(user_id)
+
+
+def save_unlock_state(user_id: int, state: dict) -> None:
+    _set_state_for(user_id, state)
 
 
 # =====================
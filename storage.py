@@ -0,0 +1,529 @@
+# storage.py
+import os
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    STORAGE_BACKEND, SQLITE_FILE, STORAGE_COMPACT_INTERVAL, STORAGE_COMPACT_RECORDS,
+    NICKNAMES_FILE, ADMINS_FILE, GUARDIAN_FILE, AFFECTION_FILE,
+    MESSAGE_LIMIT_FILE, MESSAGE_USAGE_FILE, GACHA_FILE, MYURION_FILE,
+    SPECIAL_UNLOCKS_FILE, FORMS_FILE,
+)
+
+# /data 以下の JSON ストアをプロセス全体で共有するライトビハインドキャッシュ。
+# - 各ファイルは初回アクセス時に一度だけ読み込み、以降の読み取りはメモリから返す
+# - 変更されたレコードは dirty として記録し、flush_all() でまとめてディスクへ書き出す
+# - 同じパスに対しては常に同じ JsonStore が返る（database.py / forms.py などで共有）
+# - 書き出し先は backend で切り替え（STORAGE_BACKEND=json / sqlite）
+# - bot からは aload_all() / aflush_all() を使い、ディスク I/O は専用スレッドで行う
+# - 好感度・ガチャは更新ログ（*.journal.jsonl）に追記し、定期的にスナップショットへ畳み込む
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """一時ファイルに書いて fsync → rename。途中で落ちても元ファイルは壊れない"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# --- バックエンド: JSON ファイル ---
+class JsonFileBackend:
+    """1ストア = 1ファイル。書き出しは常にファイル全体。"""
+    journaled = False
+
+    def read(self, store):
+        default = store.default_factory()
+        if not store.path.exists():
+            return default
+        try:
+            data = json.loads(store.path.read_text(encoding="utf-8"))
+        except Exception:
+            # 壊れていても bot が落ちないようにする
+            return default
+        # 期待と違う型（リスト期待なのに辞書など）ならデフォルト
+        if not isinstance(data, type(default)):
+            return default
+        return data
+
+    def snapshot(self, store, dirty_keys, dirty_all):
+        # レコードを1段コピーしておき、エンコードは write 側（I/O スレッド）で行う
+        data = store._data
+        if isinstance(data, list):
+            return list(data)
+        return {k: (dict(v) if isinstance(v, dict) else v) for k, v in data.items()}
+
+    def write(self, store, payload):
+        atomic_write_text(store.path, json.dumps(payload, ensure_ascii=False, indent=2))
+
+
+# --- バックエンド: JSON スナップショット + 追記ジャーナル ---
+# 更新ごとにファイル全体を書き直す代わりに、
+#   {"op": "set", "k": "123", "v": {...}} / {"op": "incr", "k": "123", "f": "xp", "d": 3, "v": 120} / {"op": "del", "k": "123"}
+# を <name>.journal.jsonl に追記する（flush ごとにまとめて1回 fsync）。
+# incr も結果の値 v を持つので、再生は何度やっても同じ結果になる
+# （スナップショット書き込み直後・ジャーナル削除前に落ちても二重加算しない）。
+# 起動時はスナップショット（従来の JSON ファイル）の上にジャーナルを再生し、
+# 一定時間・一定件数ごとにスナップショットへ畳み込んでジャーナルを空にする。
+def _journal_path(path: Path) -> Path:
+    return path.with_name(path.stem + ".journal.jsonl")
+
+
+def _apply_journal_record(data: dict, rec: dict) -> None:
+    op, key = rec.get("op"), rec.get("k")
+    if op == "set":
+        data[key] = rec.get("v")
+    elif op == "del":
+        data.pop(key, None)
+    elif op == "incr":
+        info = data.get(key)
+        if not isinstance(info, dict):
+            info = {}
+            data[key] = info
+        if "v" in rec:
+            info[rec["f"]] = rec["v"]
+            return
+        value = int(info.get(rec["f"], 0)) + int(rec["d"])
+        if rec.get("min") is not None:
+            value = max(rec["min"], value)
+        info[rec["f"]] = value
+
+
+class JournaledJsonBackend(JsonFileBackend):
+    journaled = True
+
+    def read(self, store):
+        data = super().read(store)
+        jpath = _journal_path(store.path)
+        count = 0
+        if jpath.exists():
+            with open(jpath, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # 書き込み途中で落ちた最後の1行は捨てる
+                        break
+                    _apply_journal_record(data, rec)
+                    count += 1
+        store._journal_count = count
+        store._last_compact = time.monotonic()
+        return data
+
+    def compaction_due(self, store) -> bool:
+        if store._journal_count <= 0:
+            return False
+        if store._journal_count + len(store._journal) >= STORAGE_COMPACT_RECORDS:
+            return True
+        return time.monotonic() - store._last_compact >= STORAGE_COMPACT_INTERVAL
+
+    def snapshot(self, store, dirty_keys, dirty_all):
+        if dirty_all or store._compact_requested:
+            # スナップショットに全部含まれるので、未書き込みのジャーナルは不要
+            store._journal = []
+            return "compact", super().snapshot(store, dirty_keys, dirty_all)
+        lines, store._journal = store._journal, []
+        return "append", lines
+
+    def write(self, store, payload):
+        mode, body = payload
+        jpath = _journal_path(store.path)
+        if mode == "compact":
+            super().write(store, body)
+            # スナップショットの rename が済んでからジャーナルを空にする
+            with open(jpath, "w", encoding="utf-8") as f:
+                f.flush()
+                os.fsync(f.fileno())
+            store._journal_count = 0
+            store._last_compact = time.monotonic()
+            return
+        if not body:
+            return
+        jpath.parent.mkdir(parents=True, exist_ok=True)
+        with open(jpath, "a", encoding="utf-8") as f:
+            f.write("".join(body))
+            f.flush()
+            os.fsync(f.fileno())
+        store._journal_count += len(body)
+
+
+# --- バックエンド: SQLite ---
+# ストアごとに1テーブル、user_id を INTEGER PRIMARY KEY にして1行ずつ UPSERT する。
+# 設定ファイル（affection_config など）はユーザー別ではないので JSON のまま。
+SQLITE_TABLES = {
+    NICKNAMES_FILE: "nicknames",
+    ADMINS_FILE: "admins",
+    GUARDIAN_FILE: "guardian_levels",
+    AFFECTION_FILE: "affection",
+    MESSAGE_LIMIT_FILE: "message_limits",
+    MESSAGE_USAGE_FILE: "message_usage",
+    GACHA_FILE: "gacha",
+    MYURION_FILE: "myurion",
+    SPECIAL_UNLOCKS_FILE: "special_unlocks",
+    FORMS_FILE: "forms",
+}
+
+
+class SqliteBackend:
+    journaled = False
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                    conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    for path, table in SQLITE_TABLES.items():
+                        if path == ADMINS_FILE:
+                            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (user_id INTEGER PRIMARY KEY)")
+                        else:
+                            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (user_id INTEGER PRIMARY KEY, value TEXT NOT NULL)")
+                    self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _table(store):
+        return SQLITE_TABLES[store.path]
+
+    def read(self, store):
+        conn = self._connect()
+        table = self._table(store)
+        with self._lock:
+            if isinstance(store.default_factory(), list):
+                return [row[0] for row in conn.execute(f"SELECT user_id FROM {table}")]
+            return {str(uid): json.loads(value) for uid, value in conn.execute(f"SELECT user_id, value FROM {table}")}
+
+    def snapshot(self, store, dirty_keys, dirty_all):
+        # user_id が数値でないキー（手で壊した JSON など）は保存対象外
+        data = store._data
+        if isinstance(data, list):
+            return "all", [(int(uid),) for uid in data]
+        if dirty_all:
+            return "all", [(int(k), json.dumps(v, ensure_ascii=False)) for k, v in data.items() if str(k).isdigit()]
+        rows = []
+        for k in dirty_keys:
+            if not str(k).isdigit(): continue
+            rows.append((int(k), json.dumps(data[k], ensure_ascii=False) if k in data else None))
+        return "rows", rows
+
+    def write(self, store, payload):
+        mode, rows = payload
+        table = self._table(store)
+        conn = self._connect()
+        with self._lock:
+            conn.execute("BEGIN")
+            try:
+                if mode == "all":
+                    conn.execute(f"DELETE FROM {table}")
+                    if store.path == ADMINS_FILE:
+                        conn.executemany(f"INSERT INTO {table} (user_id) VALUES (?)", rows)
+                    else:
+                        conn.executemany(f"INSERT INTO {table} (user_id, value) VALUES (?, ?)", rows)
+                else:
+                    upserts = [(uid, value) for uid, value in rows if value is not None]
+                    deletes = [(uid,) for uid, value in rows if value is None]
+                    conn.executemany(
+                        f"INSERT INTO {table} (user_id, value) VALUES (?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET value = excluded.value",
+                        upserts,
+                    )
+                    conn.executemany(f"DELETE FROM {table} WHERE user_id = ?", deletes)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def count(self, table: str) -> int:
+        conn = self._connect()
+        with self._lock:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+_JSON_BACKEND = JsonFileBackend()
+_JOURNALED_BACKEND = JournaledJsonBackend()
+_SQLITE_BACKEND = SqliteBackend(SQLITE_FILE)
+
+# 更新頻度が高いストアだけジャーナル方式にする（SQLite 利用時は SQLite 側の WAL に任せる）
+JOURNALED_FILES = {AFFECTION_FILE, GACHA_FILE}
+
+
+def _backend_for(path: Path):
+    if STORAGE_BACKEND == "sqlite" and path in SQLITE_TABLES:
+        return _SQLITE_BACKEND
+    if path in JOURNALED_FILES:
+        return _JOURNALED_BACKEND
+    return _JSON_BACKEND
+
+
+class JsonStore:
+    """1つのストアに対応するキャッシュ。中身は dict（ユーザー別）か list。"""
+
+    def __init__(self, path: Path, default_factory=dict, backend=None):
+        self.path = Path(path)
+        self.default_factory = default_factory
+        self.backend = backend or _backend_for(self.path)
+        self._data = None
+        self._dirty_keys = set()
+        self._dirty_all = False
+        self._lock = threading.RLock()
+        # 書き出しは1本ずつ（一時ファイル名が同じなので、古い内容が後から rename されないように）
+        self._write_lock = threading.Lock()
+        # ジャーナル用（journaled なバックエンドのときだけ使う）
+        self._journal = []
+        self._journal_count = 0
+        self._last_compact = time.monotonic()
+        self._compact_requested = False
+
+    # --- 読み込み ---
+    def _ensure_loaded(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = self.backend.read(self)
+        return self._data
+
+    def all(self):
+        """
+        キャッシュ中のデータをそのまま返す（コピーしない）。
+        書き換えた場合は replace() か touch() で dirty にすること。
+        """
+        return self._ensure_loaded()
+
+    # --- レコード単位の操作（dict ストア用） ---
+    def get(self, key: str, default=None):
+        return self._ensure_loaded().get(key, default)
+
+    def _record(self, rec: dict) -> None:
+        # 値はこの時点でエンコードしておく（後からレコードが書き換わっても影響しない）
+        if self.backend.journaled:
+            self._journal.append(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def set(self, key: str, value) -> None:
+        data = self._ensure_loaded()
+        with self._lock:
+            data[key] = value
+            self._dirty_keys.add(key)
+            self._record({"op": "set", "k": key, "v": value})
+
+    def delete(self, key: str) -> bool:
+        data = self._ensure_loaded()
+        with self._lock:
+            if key not in data:
+                return False
+            del data[key]
+            self._dirty_keys.add(key)
+            self._record({"op": "del", "k": key})
+            return True
+
+    def incr(self, key: str, field: str, delta: int, minimum=None) -> int:
+        """data[key][field] に delta を足して新しい値を返す（ジャーナルには差分だけ残る）"""
+        data = self._ensure_loaded()
+        with self._lock:
+            rec = {"op": "incr", "k": key, "f": field, "d": int(delta), "min": minimum}
+            _apply_journal_record(data, rec)
+            rec["v"] = data[key][field]
+            self._dirty_keys.add(key)
+            self._record(rec)
+            return rec["v"]
+
+    def touch(self, key: str) -> None:
+        """取得したレコードをその場で書き換えたときに dirty 扱いにする"""
+        with self._lock:
+            self._dirty_keys.add(key)
+            if self._data is not None and key in self._data:
+                self._record({"op": "set", "k": key, "v": self._data[key]})
+
+    def replace(self, data) -> None:
+        """ストア全体を差し替える（list ストアや一括更新用）"""
+        with self._lock:
+            self._data = data
+            self._dirty_all = True
+
+    # --- 書き出し ---
+    def is_loaded(self) -> bool:
+        return self._data is not None
+
+    def is_dirty(self) -> bool:
+        return self._dirty_all or bool(self._dirty_keys) or self._compact_requested
+
+    def request_compact(self) -> None:
+        if self.backend.journaled and self._data is not None:
+            self._compact_requested = True
+
+    def take_snapshot(self):
+        """dirty な内容をメモリ上で切り出す（ディスクには触らない）。なければ None"""
+        with self._lock:
+            if self._data is None:
+                return None
+            if self.backend.journaled and self.backend.compaction_due(self):
+                self._compact_requested = True
+            if not self.is_dirty():
+                return None
+            payload = self.backend.snapshot(self, self._dirty_keys, self._dirty_all)
+            self._dirty_keys = set()
+            self._dirty_all = False
+            self._compact_requested = False
+            return payload
+
+    def write_snapshot(self, payload) -> None:
+        try:
+            with self._write_lock:
+                self.backend.write(self, payload)
+        except Exception:
+            # 書けなかった分は次回まとめて書き直す
+            with self._lock:
+                self._dirty_all = True
+            raise
+
+    def flush(self) -> bool:
+        """dirty なら書き出して True を返す"""
+        payload = self.take_snapshot()
+        if payload is None:
+            return False
+        self.write_snapshot(payload)
+        return True
+
+
+# --- ストアのレジストリ ---
+_STORES: dict[Path, JsonStore] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_store(path: Path, default_factory=dict) -> JsonStore:
+    """パスに対応する共有ストアを返す（なければ作る）"""
+    key = Path(path)
+    with _REGISTRY_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = JsonStore(key, default_factory)
+            _STORES[key] = store
+        return store
+
+
+def flush_all(compact: bool = False) -> int:
+    """
+    dirty な全ストアを書き出し、書き出したストア数を返す。
+    compact=True ならジャーナルもスナップショットへ畳み込む（終了時など）。
+    """
+    if compact:
+        for store in list(_STORES.values()):
+            store.request_compact()
+    return _write_snapshots(_take_snapshots())
+
+
+def load_all() -> None:
+    """登録済みの全ストアを読み込んでおく"""
+    for store in list(_STORES.values()):
+        store.all()
+
+
+def is_all_loaded() -> bool:
+    return all(store.is_loaded() for store in list(_STORES.values()))
+
+
+def _take_snapshots():
+    pending = []
+    for store in list(_STORES.values()):
+        payload = store.take_snapshot()
+        if payload is not None:
+            pending.append((store, payload))
+    return pending
+
+
+def _write_snapshots(pending) -> int:
+    written = 0
+    for store, payload in pending:
+        try:
+            store.write_snapshot(payload)
+            written += 1
+        except Exception as e:
+            print(f"[storage] flush failed: {store.path}: {e}")
+    return written
+
+
+# --- 非同期 API（イベントループをディスクで止めない） ---
+_IO_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="storage-io")
+
+
+async def run_io(func, *args):
+    """func(*args) を I/O 専用スレッドで実行して結果を待つ"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_IO_POOL, func, *args)
+
+
+def close() -> None:
+    """I/O スレッドで実行中・待ち中の書き出しを最後まで終わらせる（終了時、最終フラッシュの前に呼ぶ）"""
+    global _IO_POOL
+    pool, _IO_POOL = _IO_POOL, ThreadPoolExecutor(max_workers=2, thread_name_prefix="storage-io")
+    pool.shutdown(wait=True)
+
+
+async def aload_all() -> None:
+    """未読み込みのストアを I/O スレッドで読み込む（読み込み済みなら何もしない）"""
+    if not is_all_loaded():
+        await run_io(load_all)
+
+
+_FLUSH_LOCK = None
+
+
+async def aflush_all() -> int:
+    """
+    スナップショットの切り出しはループ上（メモリのみ）、
+    エンコードと書き込みは I/O スレッドで行う。
+    ジャーナルの追記順が崩れないよう、フラッシュは常に1本ずつ。
+    """
+    global _FLUSH_LOCK
+    if _FLUSH_LOCK is None:
+        _FLUSH_LOCK = asyncio.Lock()
+    async with _FLUSH_LOCK:
+        pending = _take_snapshots()
+        if not pending:
+            return 0
+        return await run_io(_write_snapshots, pending)
+
+
+# --- JSON → SQLite 移行 ---
+def import_json_to_sqlite(overwrite: bool = False) -> dict:
+    """
+    既存の /data/*.json を SQLite に取り込む（一度だけ実行する想定）。
+    すでに行があるテーブルは overwrite=True のときだけ置き換える。
+    戻り値: {テーブル名: 取り込んだ件数 or None(スキップ)}
+    """
+    result = {}
+    for path, table in SQLITE_TABLES.items():
+        if not overwrite and _SQLITE_BACKEND.count(table) > 0:
+            result[table] = None
+            continue
+        default_factory = list if path == ADMINS_FILE else dict
+        # 好感度・ガチャは未畳み込みのジャーナルも再生してから取り込む
+        src = JsonStore(path, default_factory, backend=_JOURNALED_BACKEND if path in JOURNALED_FILES else _JSON_BACKEND)
+        dst = JsonStore(path, default_factory, backend=_SQLITE_BACKEND)
+        dst.replace(src.all())
+        dst.flush()
+        result[table] = len(src.all())
+    return result
+
+
+if __name__ == "__main__":
+    # 使い方: python storage.py import-json [--overwrite]
+    if len(sys.argv) >= 2 and sys.argv[1] == "import-json":
+        for table, n in import_json_to_sqlite("--overwrite" in sys.argv).items():
+            print(f"{table}: {'skipped (not empty)' if n is None else f'{n} rows'}")
+    else:
+        print("usage: python storage.py import-json [--overwrite]")
@@ -0,0 +1,43 @@
+# templates.py
+import re
+from functools import lru_cache
+
+# セリフ中の呼び名の差し込み口（{name} / {nickname} / 「あだ名」）を扱うモジュール。
+# セリフは一度だけ「差し込み口で区切った文字列のリスト」に変換しておき、
+# 描画は name.join(区切り) の1回で済ませる（str.replace を何度も重ねない）。
+# 「あだ名」はカギ括弧つきのときだけ差し込み口とみなし、本文中の単語「あだ名」はそのまま残す。
+
+_SLOT_RE = re.compile(r"\{name\}|\{nickname\}|(?<=「)あだ名(?=」)")
+
+
+class Template:
+    __slots__ = ("text", "pieces")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pieces = tuple(_SLOT_RE.split(text))
+
+    def render(self, name: str) -> str:
+        # 差し込み口がないセリフや、名前が空のときは元の文字列をそのまま返す
+        if len(self.pieces) == 1 or not name:
+            return self.text
+        return name.join(self.pieces)
+
+
+@lru_cache(maxsize=4096)
+def compile_line(text: str) -> Template:
+    return Template(text)
+
+
+def compile_corpus(corpus) -> int:
+    """セリフ集（dict / list / str の入れ子）の全セリフを先にコンパイルしておく。数を返す"""
+    if isinstance(corpus, str):
+        compile_line(corpus)
+        return 1
+    values = corpus.values() if isinstance(corpus, dict) else corpus
+    return sum(compile_corpus(v) for v in values if isinstance(v, (str, dict, list, tuple)))
+
+
+def render(text: str, name: str) -> str:
+    """text の差し込み口に name を入れる"""
+    return compile_line(text).render(name)
@@ -0,0 +1,18 @@
+# tests/conftest.py
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# config は DISCORD_TOKEN がないと import できない（テストでは接続しないのでダミーでよい）
+os.environ.setdefault("DISCORD_TOKEN", "test")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def fresh_stores(tmp_path, monkeypatch):
+    """forms / overrides のストアを空の一時ファイルに差し替える（/data には触れない）"""
+    import storage, forms, overrides
+    monkeypatch.setattr(forms, "_forms", storage.JsonStore(tmp_path / "forms.json"))
+    monkeypatch.setattr(overrides, "_overrides", storage.JsonStore(tmp_path / "overrides.json"))
@@ -0,0 +1,24 @@
+# tests/test_forms.py
+import forms
+
+
+def test_bulk_transform_without_records_is_listed(fresh_stores):
+    # 記録のある人がいなくても、一括変身は一覧に出る
+    forms.set_all_forms("aglaia")
+    assert forms.get_all_forms() == {}
+    assert forms.get_form_overrides() == {"global": "aglaia"}
+    assert forms.get_user_form(2) == "aglaia"
+
+
+def test_guild_transform_is_listed_for_that_guild_only(fresh_stores):
+    forms.set_all_forms("cerydra", guild_id=77)
+    assert forms.get_form_overrides(77) == {"guild": "cerydra"}
+    assert forms.get_form_overrides(88) == {}
+    assert forms.get_form_overrides() == {}
+
+
+def test_records_resolve_against_bulk_transform(fresh_stores):
+    forms.set_user_form(5, "furina")
+    forms.set_all_forms("aglaia")
+    forms.set_user_form(6, "momo")
+    assert forms.get_all_forms() == {"5": "aglaia", "6": "momo"}
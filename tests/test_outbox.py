@@ -0,0 +1,46 @@
+# tests/test_outbox.py
+import asyncio
+
+from outbox import Outbox
+
+
+class _Channel:
+    def __init__(self, channel_id=1):
+        self.id = channel_id
+        self.sent = []
+
+    async def send(self, text):
+        self.sent.append(text)
+
+
+def _send_all(outbox, channel, texts):
+    async def run():
+        for text in texts:
+            outbox.post(channel, text)
+        await outbox.drain()
+    asyncio.run(run())
+
+
+def test_long_reply_is_split_at_newlines():
+    box = Outbox(rate=1000, burst=1000, max_length=20)
+    ch = _Channel()
+    lines = [f"line{i:02d}-abcdefg" for i in range(5)]  # 1行15文字
+    _send_all(box, ch, ["\n".join(lines)])
+    assert all(len(t) <= 20 for t in ch.sent)
+    assert ch.sent == lines  # 2行（31文字）は収まらないので1行ずつ
+    assert "\n".join(ch.sent) == "\n".join(lines)
+
+
+def test_line_longer_than_limit_is_cut():
+    box = Outbox(rate=1000, burst=1000, max_length=10)
+    ch = _Channel()
+    _send_all(box, ch, ["x" * 25 + "\nok"])
+    assert all(len(t) <= 10 for t in ch.sent)
+    assert "".join(ch.sent).replace("\n", "") == "x" * 25 + "ok"
+
+
+def test_short_replies_are_still_merged():
+    box = Outbox(rate=1000, burst=1000, max_length=2000)
+    ch = _Channel()
+    _send_all(box, ch, ["a", "b", "c"])
+    assert ch.sent == ["a\nb\nc"]
@@ -0,0 +1,83 @@
+# triggers.py
+from functools import lru_cache
+
+# 「本文に○○が含まれているか」をまとめて判定するためのモジュール。
+# 各モジュールが import 時に register() でトリガー文字列を登録しておき、
+# scan(text) で本文を1回だけ走査して、含まれていたトリガーの集合を受け取る。
+# 中身は Aho-Corasick 法のオートマトンで、トリガーがいくつあっても走査は本文の長さに比例する。
+# 英字の大文字小文字は区別しない（登録も走査も小文字にそろえる）。
+
+
+class TriggerMatcher:
+    """複数パターンの同時照合（Aho-Corasick）"""
+
+    def __init__(self, patterns):
+        self._goto = [{}]      # 状態ごとの遷移 {文字: 次の状態}
+        self._fail = [0]       # 失敗時の戻り先
+        self._out = [()]       # その状態で見つかったパターン
+        for p in patterns:
+            self._add(p)
+        self._link()
+
+    def _add(self, pattern: str) -> None:
+        if not pattern: return
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = nxt
+        self._out[state] = self._out[state] + (pattern,)
+
+    def _link(self) -> None:
+        # 幅優先で失敗リンクを張り、戻り先の出力もまとめておく
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def scan(self, text: str) -> frozenset:
+        goto, fail, out = self._goto, self._fail, self._out
+        hits, state = set(), 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                hits.update(out[state])
+        return frozenset(hits)
+
+
+# --- 共有レジストリ ---
+_patterns = set()
+_matcher = None
+
+
+def register(*patterns) -> frozenset:
+    """トリガー文字列を登録し、正規化（小文字化）したものを返す"""
+    global _matcher
+    normalized = frozenset(p.lower() for p in patterns if p)
+    if not normalized <= _patterns:
+        _patterns.update(normalized)
+        _matcher = None
+        scan.cache_clear()
+    return normalized
+
+
+@lru_cache(maxsize=512)
+def scan(text: str) -> frozenset:
+    """text に含まれる登録済みトリガーの集合（同じ本文はキャッシュから返す）"""
+    global _matcher
+    if _matcher is None:
+        _matcher = TriggerMatcher(_patterns)
+    return _matcher.scan(text.lower())
@@ -0,0 +1,128 @@
+# user_context.py
+import database as db
+import special_unlocks
+from forms import get_user_form, set_user_form, VALID_FORM_KEYS
+from logic import get_level_from_xp, get_user_xp, XP_ACCUMULATOR
+
+# 1メッセージ分のユーザー状態をまとめて持つモジュール。
+# - on_message の最初に UserContext.load() で一度だけ組み立てる
+# - logic / reply_system にはこれを渡し、各モジュールが個別にストアを引かないようにする
+# - 変更は印（dirty）だけ付けておき、最後に commit() で一度だけ書き戻す
+
+
+class UserContext:
+    def __init__(self, user_id: int, display_name: str = "", guild_id: int = None):
+        self.user_id = user_id
+        self.display_name = display_name
+        self.guild_id = guild_id
+        self.nickname = db.get_nickname(user_id)
+        self.form = get_user_form(user_id, guild_id)
+        self.xp = get_user_xp(user_id)
+        self.gacha = db.get_gacha_state(user_id, create=False)
+        self._myurion = None  # ミュリオン関連の操作をしたときだけ読む
+        self.unlocks = special_unlocks.get_unlock_state(user_id)
+        self._affection_cfg = db.load_affection_config()
+        self.degraded = False  # 混雑時（scheduler）。好感度XPとミュリオン変換を省く
+        self._dirty = set()
+        # 加算系は差分で持っておき、commit 時に最新値へ足し込む
+        self._xp_delta = 0
+        self._janken_delta = 0
+        self._unlock_updates = {}
+
+    @classmethod
+    def load(cls, user_id: int, display_name: str = "", guild_id: int = None) -> "UserContext":
+        return cls(user_id, display_name, guild_id)
+
+    # --- 参照 ---
+    @property
+    def name(self) -> str:
+        """呼び名（あだ名がなければ表示名）"""
+        return self.nickname if self.nickname else self.display_name
+
+    @property
+    def level(self) -> int:
+        return get_level_from_xp(self.xp, self._affection_cfg)
+
+    @property
+    def affection_config(self):
+        return self._affection_cfg
+
+    @property
+    def myurion(self) -> dict:
+        if self._myurion is None:
+            self._myurion = db.get_myurion_state(self.user_id, create=False)
+        return self._myurion
+
+    @property
+    def myurion_enabled(self) -> bool:
+        # このメッセージ中に書き換えた値があればそれを、なければ db の索引を見る
+        if self._myurion is None:
+            return db.is_myurion_enabled(self.user_id, self.guild_id)
+        return db.resolve_myurion_enabled(self._myurion, self.guild_id)
+
+    @property
+    def myurion_unlocked(self) -> bool:
+        return db.is_myurion_unlocked(self.myurion, self.guild_id)
+
+    @property
+    def janken_wins(self) -> int:
+        return int(self.unlocks.get("janken_wins", 0))
+
+    # --- 変更 ---
+    def set_nickname(self, nickname: str) -> None:
+        self.nickname = nickname
+        self._dirty.add("nickname")
+
+    def set_form(self, form_key: str) -> None:
+        self.form = form_key if form_key in VALID_FORM_KEYS else "cyrene"
+        self._dirty.add("form")
+
+    def set_myurion_enabled(self, enabled: bool) -> None:
+        db.set_myurion_enabled(self.myurion, enabled)
+        self._dirty.add("myurion")
+
+    def add_xp(self, delta: int) -> None:
+        """倍率などは呼び出し側（logic.add_affection_xp）で適用済みの値を渡す"""
+        if delta == 0: return
+        self.xp = max(0, self.xp + delta)
+        self._xp_delta += delta
+        self._dirty.add("xp")
+
+    def inc_janken_win(self) -> int:
+        self.unlocks["janken_wins"] = self.janken_wins + 1
+        self._janken_delta += 1
+        self._dirty.add("unlocks")
+        return self.janken_wins
+
+    def set_unlock(self, key: str, value: bool = True) -> None:
+        self.unlocks[key] = bool(value)
+        self._unlock_updates[key] = bool(value)
+        self._dirty.add("unlocks")
+
+    def mark(self, section: str) -> None:
+        """gacha / myurion をその場で書き換えたあとに呼ぶ"""
+        self._dirty.add(section)
+
+    # --- 書き戻し ---
+    def commit(self) -> None:
+        uid = self.user_id
+        if "nickname" in self._dirty:
+            db.set_nickname(uid, self.nickname)
+        if "form" in self._dirty:
+            set_user_form(uid, self.form)
+        if "xp" in self._dirty:
+            XP_ACCUMULATOR.add(uid, self._xp_delta)
+        if "gacha" in self._dirty:
+            db.save_gacha_state(uid, self.gacha)
+        if "myurion" in self._dirty:
+            db.save_myurion_state(uid, self.myurion)
+        if "unlocks" in self._dirty:
+            state = special_unlocks.get_unlock_state(uid)
+            state.update(self._unlock_updates)
+            state["janken_wins"] = int(state.get("janken_wins", 0)) + self._janken_delta
+            special_unlocks.save_unlock_state(uid, state)
+            self.unlocks = state
+        self._dirty.clear()
+        self._xp_delta = 0
+        self._janken_delta = 0
+        self._unlock_updates = {}